@@ -0,0 +1,104 @@
+"""
+Time the import of each module in a fresh interpreter and check that no
+module pulls in heavy dependencies it only needs on first use.
+
+Run, from the repository root,
+
+    python -m benchmarks.bench_import
+
+The exit status is 1 if a module imports a forbidden dependency or takes
+longer than its budget.
+
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+heavy_modules = ['matplotlib', 'mpl_toolkits.basemap', 'sklearn',
+                 'sqlalchemy', 'scipy']
+"""The dependencies no module should import at import time."""
+
+checks = [
+    ('datatools', [], heavy_modules + ['pandas'], 0.2),
+    ('datatools.instrument', [], heavy_modules + ['pandas'], 0.2),
+    ('datatools.nbddataframe', ['pandas'], heavy_modules, 1.0),
+    ('nbdtools', [], heavy_modules + ['pandas'], 0.5),
+    ('nbdtools.nbdpred', [], heavy_modules + ['pandas'], 0.5),
+    ('nbdtools.service', [], heavy_modules + ['pandas'], 0.5),
+]
+"""The modules checked, as tuples of module name, required dependencies,
+forbidden dependencies and time budget in seconds. Whatever the required
+dependencies import themselves (e.g. some pandas versions import
+matplotlib) is not held against the module."""
+
+_probe = """
+import json, sys, time
+start = time.time()
+for required in {required!r}:
+    __import__(required)
+before = set(sys.modules)
+import {module}
+seconds = time.time() - start
+print(json.dumps({{'seconds' : seconds,
+                  'loaded' : [m for m in {forbidden!r}
+                              if m in sys.modules and m not in before]}}))
+"""
+
+
+def time_import(module, required, forbidden, repeat=3):
+    """
+    Import *module* (after its *required* dependencies) in *repeat* fresh
+    interpreters.
+
+    :param str module: the module name
+    :param list required: the dependencies the module needs anyway
+    :param list forbidden: the dependencies to look for
+    :param int repeat: the number of imports, default is 3
+
+    :returns: the fastest import time in seconds, including the required
+        dependencies, and the dependencies in *forbidden* that the module
+        imported
+    :rtype: float, list
+
+    """
+
+    best = None
+    loaded = []
+    for i in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             _probe.format(module=module, required=required,
+                           forbidden=forbidden)])
+        result = json.loads(out.strip().splitlines()[-1])
+        loaded = result['loaded']
+        if best is None or result['seconds'] < best:
+            best = result['seconds']
+    return best, loaded
+
+
+def main(argv=None):
+    summary = __doc__.split('\n\n')[0].strip()
+    parser = argparse.ArgumentParser(description=summary)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module, required, forbidden, budget in checks:
+        seconds, loaded = time_import(module, required, forbidden,
+                                      repeat=args.repeat)
+        status = 'ok'
+        if loaded:
+            status = 'imports {}'.format(', '.join(loaded))
+            failed = True
+        elif seconds > budget:
+            status = 'over budget of {} s'.format(budget)
+            failed = True
+        print '{:<25} {:>8.3f} s  {}'.format(module, seconds, status)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,337 @@
+"""
+Time and memory-profile each stage of the pipeline on synthetic data made
+by :mod:`datatools.synthetic`, and store the results so that versions can be
+compared.
+
+Each case runs in its own process so that its peak memory is not hidden by
+an earlier case. Run, from the repository root,
+
+    python -m benchmarks.bench_pipeline --sizes 1000 100000 --label v0.1
+
+and compare two stored runs with
+
+    python -m benchmarks.bench_pipeline --compare old.json new.json
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import shutil
+import subprocess
+import tempfile
+import time
+
+from datatools.instrument import current_rss, PeakMemorySampler
+
+
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+"""The default directory the results are stored in."""
+
+default_sizes = [1000, 10000, 100000, 1000000, 10000000]
+"""The default numbers of rows."""
+
+
+#each case is (name, largest size, setup): setup(size, workdir) returns a
+#no-argument function running the stage being measured
+
+def _setup_get_csv_data(size, workdir):
+    from datatools.nbddataframe import get_csv_data
+    from datatools.synthetic import write_testdata
+    filename = os.path.join(workdir, 'bench.csv')
+    write_testdata(filename, size, seed=0)
+    return lambda: get_csv_data(filename=filename, nbdname='neighborhood',
+                                latname='lat', longname='lon',
+                                datename='date', sep='\t')
+
+
+def _make_nbddf(size):
+    from datatools.nbddataframe import NBDDataFrame, rename_cols
+    from datatools.synthetic import make_testdata_frame
+    df = rename_cols(make_testdata_frame(size, seed=0),
+                     nbdname='neighborhood', latname='lat', longname='lon')
+    return NBDDataFrame(df)
+
+
+def _setup_make_db(size, workdir):
+    from datatools.nbddataframe import make_db
+    nbddf = _make_nbddf(size)
+    dbname = os.path.join(workdir, 'bench')
+    return lambda: make_db(nbddf, dbname=dbname)
+
+
+def _setup_get_db_data(size, workdir):
+    from datatools.nbddataframe import make_db, get_db_data
+    engine = make_db(_make_nbddf(size), dbname=os.path.join(workdir, 'bench'))
+    return lambda: get_db_data(engine, nbdname='nbd')
+
+
+def _setup_remove_missing_data(size, workdir):
+    return _make_nbddf(size).remove_missing_data
+
+
+def _setup_remove_outofbounds_data(size, workdir):
+    return _make_nbddf(size).remove_outofbounds_data
+
+
+def _setup_print_info(size, workdir):
+    return _make_nbddf(size).print_info
+
+
+def _setup_plot_rowcount_by_month(size, workdir):
+    nbddf = _make_nbddf(size)
+    filename = os.path.join(workdir, 'rowcount.png')
+    return lambda: nbddf.plot_rowcount_by_month(filename=filename)
+
+
+def _setup_plot_map(size, workdir):
+    nbddf = _make_nbddf(size)
+    filename = os.path.join(workdir, 'map.png')
+    return lambda: nbddf.plot_map(filename=filename)
+
+
+def _setup_render_batch(size, workdir):
+    nbddf = _make_nbddf(size)
+    nbds = sorted(nbddf.get_df()['nbd'].dropna().unique())
+    jobs = [(nbd, chart, os.path.join(workdir, '{}-{}.png'.format(chart, i)))
+            for i, nbd in enumerate(nbds)
+            for chart in ['rowcount_by_month', 'map']]
+    return lambda: nbddf.render(jobs)
+
+
+def _setup_nbdpred_init(size, workdir):
+    from datatools.synthetic import make_loc_and_n
+    from nbdtools.nbdpred import NbdPred
+    loc_and_n = make_loc_and_n(size, seed=0)
+    return lambda: NbdPred(loc_and_n)
+
+
+def _setup_make_predictor(size, workdir):
+    from datatools.synthetic import make_loc_and_n
+    from nbdtools.nbdpred import NbdPred
+    npred = NbdPred(make_loc_and_n(size, seed=0))
+    return lambda: npred.make_predictor(train_percent=0.9)
+
+
+def _setup_plot_decision_regions(size, workdir):
+    import matplotlib.pyplot as plt
+    from datatools.synthetic import make_loc_and_n
+    from nbdtools.nbdpred import NbdPred
+    npred = NbdPred(make_loc_and_n(size, seed=0))
+    npred.NN = npred.make_predictor(train_percent=0.9)[0]
+    plt.show = lambda: None
+    return npred.plot_decision_regions
+
+
+def _setup_indicator_engine(size, workdir):
+    from datatools.indicators import IndicatorEngine
+    nbddf = _make_nbddf(size)
+    metrics = [(None, 'count'), ('val', 'sum'), ('val', 'mean')]
+    indicators = []
+    for metric in ['count', 'val_sum', 'val_mean']:
+        for transform in ['rolling_sum', 'rolling_mean', 'growth', 'zscore']:
+            for window in [3, 12]:
+                indicators.append(('{}_{}_{}'.format(metric, transform,
+                                                     window),
+                                   metric, transform, window))
+
+    def stage():
+        engine = IndicatorEngine(metrics, indicators)
+        engine.update(nbddf)
+        return engine.panel()
+    return stage
+
+
+cases = [
+    ('get_csv_data', None, _setup_get_csv_data),
+    ('make_db', None, _setup_make_db),
+    ('get_db_data', None, _setup_get_db_data),
+    ('remove_missing_data', None, _setup_remove_missing_data),
+    ('remove_outofbounds_data', None, _setup_remove_outofbounds_data),
+    ('print_info', None, _setup_print_info),
+    ('plot_rowcount_by_month', None, _setup_plot_rowcount_by_month),
+    ('plot_map', 1000000, _setup_plot_map),
+    ('render_batch', 1000000, _setup_render_batch),
+    ('NbdPred.__init__', 1000000, _setup_nbdpred_init),
+    ('make_predictor', 3000, _setup_make_predictor),
+    ('plot_decision_regions', 3000, _setup_plot_decision_regions),
+    ('IndicatorEngine', None, _setup_indicator_engine),
+]
+"""The benchmark cases, as tuples of name, largest size (None for no
+limit) and setup function."""
+
+
+def _run_case(setup, size, queue):
+    import matplotlib
+    matplotlib.use('Agg')
+    workdir = tempfile.mkdtemp()
+    try:
+        stage = setup(size, workdir)
+        before = current_rss()
+        with PeakMemorySampler() as sampler:
+            start = time.time()
+            stage()
+            seconds = time.time() - start
+        queue.put({'seconds' : seconds,
+                   'peak_mem_mb' : (sampler.peak - before) / 2.0 ** 20})
+    except Exception as e:
+        queue.put({'error' : '{}: {}'.format(type(e).__name__,
+                                             ' '.join(str(e).split()))})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_case(name, size):
+    """
+    Run one benchmark case in a separate process.
+
+    :param str name: the name of the case, one of :attr:`cases`
+    :param int size: the number of rows
+
+    :returns: the case name, size, and the time in seconds and peak
+        additional memory in MB of the stage, or the error it raised (or
+        the exit code of its process, if it died)
+    :rtype: dict
+
+    """
+
+    setup = dict((c[0], c[2]) for c in cases)[name]
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_case,
+                                   args=(setup, size, queue))
+    proc.start()
+    #the child may die without a result, e.g. killed when out of memory
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Queue.Empty:
+            if not proc.is_alive():
+                proc.join()
+                result = {'error' : 'exit code {}'.format(proc.exitcode)}
+                break
+    proc.join()
+    result.update({'case' : name, 'size' : size})
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+                                        'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(sizes=None, names=None, label=None):
+    """
+    Run the benchmark cases *names* (all by default) at each of *sizes*
+    (:attr:`default_sizes` by default), skipping sizes above a case's
+    largest size.
+
+    :returns: the run, with its label, platform and results
+    :rtype: dict
+
+    """
+
+    sizes = sizes or default_sizes
+    results = []
+    for name, maxsize, setup in cases:
+        if names and name not in names:
+            continue
+        for size in sizes:
+            if maxsize is not None and size > maxsize:
+                continue
+            result = run_case(name, size)
+            print format_result(result)
+            results.append(result)
+
+    return {'label' : label or _git_revision(),
+            'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python' : platform.python_version(),
+            'machine' : platform.machine(),
+            'cpus' : multiprocessing.cpu_count(),
+            'results' : results}
+
+
+def format_result(result):
+    """
+    Format one benchmark result as a line of text.
+
+    """
+
+    if 'error' in result:
+        return '{case:<25} {size:>9} error: {error}'.format(**result)
+    return ('{case:<25} {size:>9} {seconds:>10.4f} s '
+            '{peak_mem_mb:>10.1f} MB').format(**result)
+
+
+def compare(old, new, tolerance=1.25):
+    """
+    Compare two benchmark runs.
+
+    :param dict old: the earlier run
+    :param dict new: the later run
+    :param float tolerance:
+        a case regresses if its time or memory grows by more than this
+        factor, default is 1.25
+
+    :returns: the regressions, as lines of text
+    :rtype: list
+
+    """
+
+    oldresults = dict(((r['case'], r['size']), r) for r in old['results']
+                      if 'error' not in r)
+    regressions = []
+    for r in new['results']:
+        o = oldresults.get((r['case'], r['size']))
+        if o is None or 'error' in r:
+            continue
+        for key, floor in (('seconds', 0.01), ('peak_mem_mb', 1.0)):
+            if r[key] > max(o[key], floor) * tolerance:
+                regressions.append(
+                    '{} at {} rows: {} {:.4g} -> {:.4g}'.format(
+                        r['case'], r['size'], key, o[key], r[key]))
+    return regressions
+
+
+def main(argv=None):
+    summary = __doc__.split('\n\n')[0].strip()
+    parser = argparse.ArgumentParser(description=summary)
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--cases', nargs='+')
+    parser.add_argument('--label')
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(old, new, tolerance=args.tolerance)
+        for line in regressions:
+            print line
+        return 1 if regressions else 0
+
+    run = run_suite(sizes=args.sizes, names=args.cases, label=args.label)
+    output = args.output
+    if output is None:
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        output = os.path.join(results_dir, '{}.json'.format(run['label']))
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+    print 'Results written to {}'.format(output)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,64 +1,348 @@
+"""
+A streaming importer of csv exports (e.g. ``culture.csv``) into a
+database. Rows are read one at a time, normalized, and inserted in
+batches through a pooled connection created on first use, so memory does
+not grow with the size of the file.
+
+With identifying columns (``--keys``), the import goes through the import
+ledger of :mod:`datatools.ledger`: an unchanged file is skipped, and only
+the new and changed rows of a re-export are written.
+
+Run, for example,
+
+    python csv_importer.py culture.csv --db sqlite:///gentry.db \
+        --keys name,address
+
+"""
+
+import argparse
 import csv
-import MySQLdb
-import pprint
-from sql import *
-from sql.aggregate import *
-from sql.conditionals import *
-
-class importer():
-    csvfilename = ''
-    row = 0
-    parsedDict = []
-    db = MySQLdb.Connect(host='localhost',
-                     user='root',
-                     db = 'gentry')
-    
-    def __init__(self, filename):
+import itertools
+import os
+from collections import OrderedDict
+
+from datatools.ledger import ImportLedger, row_key, row_digest
+from datatools.schema import normalize_name, read_typed_csv
+
+
+default_dburl = 'mysql://root@localhost/gentry'
+"""The default database URL."""
+
+#engines (and their connection pools) shared by all importers, by URL
+_engines = {}
+
+
+def get_engine(dburl):
+    """
+    Get the engine of the database *dburl*, creating it on first use.
+    Engines are shared, so all importers of one database share a
+    connection pool.
+
+    """
+
+    if dburl not in _engines:
+        from sqlalchemy import create_engine
+        _engines[dburl] = create_engine(dburl, pool_recycle=3600)
+    return _engines[dburl]
+
+
+class importer(object):
+    """
+    A streaming importer of the csv file *filename* into the database
+    *dburl*.
+
+    :param str filename: the name of the csv file
+    :param str dburl:
+        the database URL, default is :attr:`default_dburl`; a local SQLite
+        database such as 'sqlite:///gentry.db' works too
+    :param int batchsize: the number of rows inserted at once, default is 1000
+    :param str encoding: the encoding of the file, default is 'utf-8'
+
+    For example,
+
+    >>> from csv_importer import importer
+    >>> fil = open('test_import.csv', 'w')
+    >>> fil.write('Name,Seats total?\\nA, 10\\nB,\\nC,30\\n')
+    >>> fil.close()
+    >>> imp = importer('test_import.csv', dburl='sqlite://', batchsize=2)
+    >>> imp.getHeader()
+    [u'name', u'seats_total']
+    >>> imp.importFile('culture')
+    3
+    >>> con = imp.getEngine().connect()
+    >>> con.execute('select * from culture').fetchall()
+    [(u'A', u'10'), (u'B', None), (u'C', u'30')]
+    >>> con.close()
+
+    """
+
+    def __init__(self, filename, dburl=default_dburl, batchsize=1000,
+                 encoding='utf-8'):
+        self.row = 0
         self.setFilename(filename)
-        pass
-    
-    def setFilename(self,filename):
+        self.dburl = dburl
+        self.batchsize = batchsize
+        self.encoding = encoding
+
+    def setFilename(self, filename):
         self.csvfilename = filename
-        pass
-    #Will read from specified line using an internal counter by default
-    def readFile(self):
-        with open(self.csvfilename, 'rb') as csvfile:
-            spamreader = csv.DictReader(csvfile)
-            for row in spamreader:
-               self.parsedDict.append(row)
-        pass
-    
+        self.row = 0
+
+    def getEngine(self):
+        """
+        Get the database engine, creating it on first use.
+
+        """
+
+        return get_engine(self.dburl)
+
     def getHeader(self):
+        """
+        Get the normalized names of the columns.
+
+        """
+
+        with open(self.csvfilename, 'rb') as csvfile:
+            header = next(csv.reader(csvfile))
+        return [self.normalize_text(x.decode(self.encoding)) for x in header]
+
+    def readFile(self):
+        """
+        Generate the rows of the file as dicts from normalized column name
+        to decoded value, with surrounding whitespace removed and empty
+        values replaced by None. :attr:`row` counts the rows read.
+
+        """
+
         with open(self.csvfilename, 'rb') as csvfile:
-            spamreader = csv.DictReader(csvfile)
-            header = spamreader[0]
-            header_keys = [normalize_text(x) in header.keys()]
-        pass
-    
+            reader = csv.reader(csvfile)
+            header = [self.normalize_text(x.decode(self.encoding))
+                      for x in next(reader)]
+            for values in reader:
+                self.row += 1
+                values = [v.decode(self.encoding).strip() or None
+                          for v in values]
+                values += [None] * (len(header) - len(values))
+                yield dict(zip(header, values))
+
+    def readBatches(self, rows=None):
+        """
+        Group *rows* (by default, those of :meth:`readFile`) into lists of
+        at most :attr:`batchsize` rows.
+
+        """
+
+        rows = self.readFile() if rows is None else iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batchsize))
+            if not batch:
+                return
+            yield batch
+
+    def getTable(self, tablename, keyed=False):
+        """
+        Get the database table *tablename*, creating it with a text column
+        for each column of the file if it does not exist, and, if *keyed*,
+        an indexed 'row_key' column for the keys of the import ledger.
+
+        """
+
+        from sqlalchemy import MetaData, Table, Column, Text, String
+
+        engine = self.getEngine()
+        metadata = MetaData()
+        with engine.connect() as con:
+            exists = engine.dialect.has_table(con, tablename)
+        if exists:
+            table = Table(tablename, metadata, autoload=True,
+                          autoload_with=engine)
+            if keyed and 'row_key' not in table.c:
+                raise Exception('Table {} has no row_key column'.format(
+                                tablename))
+            return table
+        columns = [Column(name, Text) for name in self.getHeader()]
+        if keyed:
+            columns.append(Column('row_key', String(40), index=True))
+        table = Table(tablename, metadata, *columns)
+        table.create(engine)
+        return table
+
+    def getTablename(self, tablename=None):
+        """
+        Get *tablename*, by default the normalized file name.
+
+        """
+
+        if tablename is None:
+            base = os.path.splitext(os.path.basename(self.csvfilename))[0]
+            tablename = self.normalize_text(base)
+        return tablename
+
+    def importFile(self, tablename=None):
+        """
+        Insert the rows of the file into the table *tablename* (by
+        default, the normalized file name), one transaction per batch.
+
+        :returns: the number of rows inserted
+
+        """
+
+        tablename = self.getTablename(tablename)
+        table = self.getTable(tablename)
+        inserted = 0
+        with self.getEngine().connect() as con:
+            for batch in self.readBatches():
+                with con.begin():
+                    con.execute(table.insert(), batch)
+                inserted += len(batch)
+        return inserted
+
+    def syncFile(self, keys, tablename=None, ledger=None):
+        """
+        Import the file into the table *tablename* (by default, the
+        normalized file name) through the import ledger: nothing is read
+        if the file did not change since its last import; otherwise the
+        rows whose key (the normalized values of the columns *keys*) is
+        new are inserted, the rows whose content changed are updated, and
+        the others are skipped. A key repeated in the file is written
+        once, with its last row.
+
+        :param list keys: the normalized names of the identifying columns
+        :param ledger:
+            (optional) the :class:`datatools.ledger.ImportLedger`, default
+            is the ledger of the database
+
+        :returns: the numbers of rows inserted, updated and unchanged, or
+            None if the file was skipped
+        :rtype: dict
+
+        For example, we import a file, then a re-export of it with one
+        changed row and one new row.
+
+        >>> from csv_importer import importer
+        >>> fil = open('test_sync.csv', 'w')
+        >>> fil.write('Name,Address,Seats\\nA,1 Pine St,10\\n'
+        ...           'B,2 Pike St,20\\n')
+        >>> fil.close()
+        >>> imp = importer('test_sync.csv', dburl='sqlite://')
+        >>> sorted(imp.syncFile(['name', 'address']).items())
+        [('inserted', 2), ('unchanged', 0), ('updated', 0)]
+        >>> imp.syncFile(['name', 'address']) is None
+        True
+        >>> fil = open('test_sync.csv', 'w')
+        >>> fil.write('Name,Address,Seats\\nA,1 Pine St,10\\n'
+        ...           'B,2 Pike St,25\\nC,3 Union St,30\\n')
+        >>> fil.close()
+        >>> sorted(imp.syncFile(['name', 'address']).items())
+        [('inserted', 1), ('unchanged', 1), ('updated', 1)]
+        >>> con = imp.getEngine().connect()
+        >>> con.execute('select name, seats from test_sync').fetchall()
+        [(u'A', u'10'), (u'B', u'25'), (u'C', u'30')]
+        >>> con.close()
+
+        """
+
+        from sqlalchemy import bindparam
+
+        tablename = self.getTablename(tablename)
+        if ledger is None:
+            ledger = ImportLedger(self.getEngine())
+        filedigest = ledger.file_changed(self.csvfilename, tablename)
+        if filedigest is None:
+            return None
+
+        header = self.getHeader()
+        missing = [key for key in keys if key not in header]
+        if missing:
+            raise Exception('Key columns {} not in {}'.format(
+                            ', '.join(missing), self.csvfilename))
+
+        table = self.getTable(tablename, keyed=True)
+        update = table.update().where(table.c.row_key == bindparam('b_key'))
+        counts = {'inserted' : 0, 'updated' : 0, 'unchanged' : 0}
+        rows = 0
+        with self.getEngine().connect() as con:
+            for batch in self.readBatches():
+                rows += len(batch)
+                batchkeys = [row_key(row, keys) for row in batch]
+                #the recorded digests of the keys of this batch only
+                digests = ledger.row_digests(tablename, batchkeys)
+                #the last row of each key in the batch, in order
+                changed = OrderedDict()
+                for key, row in zip(batchkeys, batch):
+                    digest = row_digest(row, header)
+                    changed.pop(key, None)
+                    if digests.get(key) != digest:
+                        changed[key] = (row, digest)
+                    else:
+                        counts['unchanged'] += 1
+                inserts = []
+                updates = []
+                for key, (row, digest) in changed.items():
+                    row = dict(row)
+                    if key in digests:
+                        row['b_key'] = key
+                        updates.append(row)
+                    else:
+                        row['row_key'] = key
+                        inserts.append(row)
+                with con.begin():
+                    if inserts:
+                        con.execute(table.insert(), inserts)
+                    if updates:
+                        con.execute(update, updates)
+                    ledger.record_rows(tablename, [(key, digest) for key,
+                                       (row, digest) in changed.items()],
+                                       digests, con=con)
+                counts['inserted'] += len(inserts)
+                counts['updated'] += len(updates)
+
+        ledger.record_file(self.csvfilename, tablename, rows=rows,
+                           digest=filedigest)
+        return counts
+
+    def readTyped(self, schema=None, chunksize=100000, nprocs=None):
+        """
+        Read the file into a typed, compact DataFrame, with the schema
+        inferred from a sample of the rows if *schema* is None, in
+        *nprocs* processes if it is more than 1 (see
+        :func:`datatools.schema.read_typed_csv`).
+
+        """
+
+        return read_typed_csv(self.csvfilename, schema=schema,
+                              chunksize=chunksize, nprocs=nprocs)
+
     def normalize_text(self, text):
-        final_text = text.lower().replace(" ", "_").strip()
+        final_text = normalize_name(text)
         return final_text
-    
-    
-    pass
-
-#
-#from peewee import *
-#import MySQLdb
-#
-#database = MySQLDatabase('gentry')
-#
-#
-#cur = db.cursor()
-#
-#cur.execute("select * from building_permit limit 10")
-
-parsedDict = []
-with open('culture.csv', 'rb') as csvfile:
-            spamreader = csv.DictReader(csvfile)
-            for row in spamreader:
-               parsedDict.append(row)
-               
-               
-pprint.pprint(parsedDict[0].keys())
-str = "Seats total"
+
+
+def main(argv=None):
+    summary = __doc__.split('\n\n')[0].strip()
+    parser = argparse.ArgumentParser(description=summary)
+    parser.add_argument('filename')
+    parser.add_argument('--db', default=default_dburl)
+    parser.add_argument('--table')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--keys', help='comma separated identifying columns '
+                        'of the rows, to import through the ledger')
+    args = parser.parse_args(argv)
+
+    imp = importer(args.filename, dburl=args.db, batchsize=args.batch_size,
+                   encoding=args.encoding)
+    if not args.keys:
+        print '{} rows imported'.format(imp.importFile(args.table))
+        return
+    keys = [normalize_name(key) for key in args.keys.split(',')]
+    counts = imp.syncFile(keys, tablename=args.table)
+    if counts is None:
+        print '{} unchanged, skipped'.format(args.filename)
+    else:
+        print ('{inserted} rows inserted, {updated} updated, '
+               '{unchanged} unchanged'.format(**counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 """
 This package includes tools to analyze neighborhood data.
 
-"""
+The modules are not imported here, so that importing one module (e.g.
+:mod:`datatools.instrument` from :mod:`nbdtools`) does not pull in the
+dependencies of the others: import them as e.g.
+``import datatools.nbddataframe``.
 
-import nbddataframe
+"""
@@ -0,0 +1,278 @@
+"""
+Tools to compute kernel density surfaces of neighborhood data, e.g. the
+density of permits per year: the points are binned onto a grid over the
+map bounds, and the grid is convolved with a Gaussian kernel by FFT, so
+that the cost after binning does not depend on the number of points.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from panels import period_ordinals
+from projection import earth_radius
+
+
+def _gaussian_kernel(sigma_y, sigma_x, truncate=4.0):
+    """
+    Get the Gaussian kernel with standard deviations *sigma_y* and
+    *sigma_x* (in cells), truncated at *truncate* standard deviations and
+    normalized to sum to 1.
+
+    """
+
+    half_y = max(int(np.ceil(truncate * sigma_y)), 1)
+    half_x = max(int(np.ceil(truncate * sigma_x)), 1)
+    y = np.arange(-half_y, half_y + 1)[:, None] / float(sigma_y)
+    x = np.arange(-half_x, half_x + 1)[None, :] / float(sigma_x)
+    kernel = np.exp(-0.5 * (y ** 2 + x ** 2))
+    return kernel / kernel.sum()
+
+
+def smooth_grids(grids, kernel, batchsize=64):
+    """
+    Convolve each 2-D grid of *grids* with *kernel* by FFT, keeping the
+    grid shape (the grids are zero padded, so nothing wraps around).
+
+    Parameters:
+    ___________
+
+    :param numpy.ndarray grids:
+        the grids, with shape (number of grids, height, width)
+
+    :param numpy.ndarray kernel:
+        the kernel, with odd height and width
+
+    :param int batchsize:
+        the number of grids transformed at once, default is 64
+
+    Returns:
+    ________
+
+    :returns: the smoothed grids
+    :rtype: numpy.ndarray
+
+    For example, a single point becomes the kernel.
+
+    >>> import numpy as np
+    >>> from datatools.density import smooth_grids
+    >>> grids = np.zeros((1, 5, 5))
+    >>> grids[0, 2, 2] = 1
+    >>> kernel = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]]) / 8.
+    >>> np.allclose(smooth_grids(grids, kernel)[0, 1:4, 1:4], kernel)
+    True
+
+    """
+
+    height, width = grids.shape[1:]
+    kh, kw = kernel.shape
+    fftshape = (height + kh - 1, width + kw - 1)
+    kernelfft = np.fft.rfft2(kernel, fftshape)
+
+    smoothed = np.empty(grids.shape)
+    top, left = kh // 2, kw // 2
+    for start in range(0, len(grids), batchsize):
+        batch = np.fft.rfft2(grids[start:start + batchsize], fftshape)
+        full = np.fft.irfft2(batch * kernelfft, fftshape)
+        smoothed[start:start + batchsize] = \
+            full[:, top:top + height, left:left + width]
+    if smoothed.size > 0:
+        #remove the rounding noise of the transforms around empty cells
+        smoothed[smoothed < 1e-12 * max(smoothed.max(), 1)] = 0
+    return smoothed
+
+
+class DensitySurfaces(object):
+    """
+    Kernel density surfaces on a latitude by longitude grid, one for each
+    key: a tuple *(nbd, period)*, where *nbd* is None if the surfaces are
+    not by neighborhood and *period* is None if they are not by period.
+
+    The density is in points per square kilometer.
+
+    Parameters:
+    ___________
+
+    :param list keys:
+        the keys, in the order of the first axis of *values*
+
+    :param numpy.ndarray values:
+        the surfaces, with shape (number of keys, number of latitude
+        cells, number of longitude cells), from south to north and west
+        to east
+
+    :param numpy.ndarray lat_edges:
+        the latitudes of the cell edges
+
+    :param numpy.ndarray long_edges:
+        the longitudes of the cell edges
+
+    :param float bandwidth:
+        the standard deviation of the kernel, in meters
+
+    :param str freq:
+        (optional) the frequency of the periods, if the surfaces are by
+        period; default is None
+
+    """
+
+    def __init__(self, keys, values, lat_edges, long_edges, bandwidth,
+                 freq=None):
+
+        self.keys = keys
+        self.values = values
+        self.lat_edges = lat_edges
+        self.long_edges = long_edges
+        self.bandwidth = bandwidth
+        self.freq = freq
+
+    def get(self, nbd=None, period=None):
+        """
+        Get the surface of the neighborhood *nbd* and the period *period*
+        (a :class:`pandas.Period`, or anything it can be made from). A key
+        with no rows has a zero surface.
+
+        :rtype: numpy.ndarray
+
+        :raises Exception: if a period is given and the surfaces are not
+            by period
+
+        """
+
+        if period is not None:
+            if self.freq is None:
+                raise Exception('The surfaces are not by period')
+            period = pd.Period(period, freq=self.freq)
+        key = (nbd, period)
+        if key not in self.keys:
+            return np.zeros(self.values.shape[1:])
+        return self.values[self.keys.index(key)]
+
+    def difference(self, key, other):
+        """
+        Get the surface of the key *key* minus the surface of the key
+        *other*, the keys being *(nbd, period)* tuples as in :meth:`get`.
+
+        :rtype: numpy.ndarray
+
+        """
+
+        return self.get(*key) - self.get(*other)
+
+    def extent(self):
+        """
+        Get the extent of the grid, as (west, east, south, north), e.g.
+        for :meth:`matplotlib.axes.Axes.imshow`.
+
+        """
+
+        return (self.long_edges[0], self.long_edges[-1],
+                self.lat_edges[0], self.lat_edges[-1])
+
+    def plot(self, surface, filename, title=None):
+        """
+        Plot the surface *surface* (e.g. from :meth:`get` or
+        :meth:`difference`) into the image file *filename*.
+
+        """
+
+        from render import new_figure, draw_density
+
+        fig, ax = new_figure()
+        draw_density(ax, surface, self.extent(), title=title)
+        fig.savefig(filename, dpi=200)
+
+
+def density_surfaces(df, bounds, by_nbd=False, freq=None, bandwidth=300.,
+                     shape=(200, 200)):
+    """
+    Compute kernel density surfaces of the points of *df*.
+
+    Parameters:
+    ___________
+
+    :param pandas.DataFrame df:
+        the data, with *latitude* and *longitude* columns, an *nbd*
+        column if *by_nbd*, and a *date* column if *freq* is given
+
+    :param tuple bounds:
+        the grid bounds, as (min_lat, max_lat, min_long, max_long); the
+        points outside are left out
+
+    :param bool by_nbd:
+        compute a surface for each neighborhood, default is False
+
+    :param str freq:
+        (optional) compute a surface for each period of this frequency,
+        default is None
+
+    :param float bandwidth:
+        the standard deviation of the Gaussian kernel in meters, default
+        is 300
+
+    :param tuple shape:
+        the number of latitude and longitude cells, default is (200, 200)
+
+    Returns:
+    ________
+
+    :returns: the surfaces
+    :rtype: :class:`DensitySurfaces`
+
+    """
+
+    min_lat, max_lat, min_long, max_long = bounds
+    height, width = shape
+    lat_edges = np.linspace(min_lat, max_lat, height + 1)
+    long_edges = np.linspace(min_long, max_long, width + 1)
+
+    lat = np.asarray(df['latitude'], dtype=float)
+    lon = np.asarray(df['longitude'], dtype=float)
+    with np.errstate(invalid='ignore'):
+        valid = ((lat >= min_lat) & (lat <= max_lat) &
+                 (lon >= min_long) & (lon <= max_long))
+
+    #the group of each row, from the neighborhood and period codes
+    groups = np.zeros(len(df), dtype=np.int64)
+    nbds, periods = [None], [None]
+    if by_nbd:
+        nbdcodes = pd.Categorical(df['nbd'])
+        nbds = list(nbdcodes.categories)
+        codes = np.asarray(nbdcodes.codes, dtype=np.int64)
+        valid &= codes >= 0
+        groups = codes
+    if freq is not None:
+        ordinals, dated = period_ordinals(df, freq)
+        valid &= dated
+        if valid.any():
+            first = ordinals[valid].min()
+            num_periods = ordinals[valid].max() - first + 1
+        else:
+            first, num_periods = 0, 0
+        periods = list(pd.period_range(start=pd.Period(ordinal=first,
+                                                       freq=freq),
+                                       periods=num_periods, freq=freq))
+        groups = groups * num_periods + (ordinals - first)
+
+    row = np.clip(((lat[valid] - min_lat) / (max_lat - min_lat) *
+                   height).astype(np.int64), 0, height - 1)
+    col = np.clip(((lon[valid] - min_long) / (max_long - min_long) *
+                   width).astype(np.int64), 0, width - 1)
+
+    #bin the groups with points only, as there may be many empty ones
+    #(e.g. neighborhoods by month)
+    nonempty, compact = np.unique(groups[valid], return_inverse=True)
+    keys = [(nbds[g // len(periods)], periods[g % len(periods)])
+            for g in nonempty]
+    cells = (compact * height + row) * width + col
+    grids = np.bincount(cells, minlength=len(keys) * height * width)
+    grids = grids.astype(float).reshape(len(keys), height, width)
+
+    meters_lat = np.radians(max_lat - min_lat) / height * earth_radius
+    meters_long = (np.radians(max_long - min_long) / width * earth_radius *
+                   np.cos(np.radians((min_lat + max_lat) / 2.)))
+    kernel = _gaussian_kernel(bandwidth / meters_lat, bandwidth / meters_long)
+    values = smooth_grids(grids, kernel) / (meters_lat * meters_long / 1e6)
+
+    return DensitySurfaces(keys, values, lat_edges, long_edges, bandwidth,
+                           freq=freq)
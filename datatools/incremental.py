@@ -0,0 +1,300 @@
+"""
+Tools to load neighborhood data from a database incrementally: only the
+rows newer than a persisted high-water mark are read on each load, and
+appended to a cached :class:`~datatools.nbddataframe.NBDDataFrame`.
+
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from nbddataframe import NBDDataFrame, minlat, maxlat, minlong, maxlong
+
+
+def _to_json_mark(mark):
+    if isinstance(mark, (pd.Timestamp, np.datetime64)):
+        return {'type' : 'datetime', 'value' : pd.Timestamp(mark).isoformat()}
+    if isinstance(mark, (np.integer, int, long)):
+        return {'type' : 'int', 'value' : int(mark)}
+    return {'type' : 'float', 'value' : float(mark)}
+
+
+def _from_json_mark(jsonmark):
+    if jsonmark['type'] == 'datetime':
+        return pd.Timestamp(jsonmark['value']).to_pydatetime()
+    return jsonmark['value']
+
+
+class IncrementalLoader(object):
+    """
+    An incremental loader of a database table of neighborhood data. The
+    high-water mark (the largest value of *watermark_col* loaded so far)
+    and running statistics of each table are kept in *cachedir*, along
+    with the loaded rows, written as one part file per load; once there
+    are more than *max_parts* part files, they are compacted into one.
+
+    The first :meth:`load` reads the whole table (or the cached parts, if
+    there are any); each later load reads only the rows whose
+    *watermark_col* is greater than the mark. A primary key makes the
+    best watermark: a date watermark misses rows added later with a date
+    already loaded.
+
+    Only the database read scales with the rows added since the last
+    load: the first load of a new loader reads all the cached parts, and
+    reading the data (e.g. :meth:`NBDDataFrame.get_df`) after a load
+    concatenates the new rows to the loaded ones.
+
+    Parameters:
+    ___________
+
+    :param sqlalchemy.engine.Engine engine:
+        the database engine
+
+    :param str cachedir:
+        the directory of the watermarks, statistics and cached rows
+
+    :param str tablename:
+        the name of the database table, default is 'nbddata'
+
+    :param str watermark_col:
+        the name of the watermark column in the table, default is 'date'
+
+    :param int max_parts:
+        the largest number of part files kept before they are compacted,
+        default is 10
+
+    The other parameters are as in
+    :func:`~datatools.nbddataframe.get_db_data`.
+
+    For example, we load a table, add two rows to it and load again.
+
+    >>> import tempfile
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.nbddataframe import make_db
+    >>> from datatools.incremental import IncrementalLoader
+    >>> engine = make_db(NBDDataFrame(get_testdataframe()))
+    >>> cachedir = tempfile.mkdtemp()
+    >>> loader = IncrementalLoader(engine, cachedir, nbdname='nbd',
+    ...                            watermark_col='index', index_col='index')
+    >>> len(loader.load().get_df())
+    13
+    >>> newrows = get_testdataframe().iloc[:2]
+    >>> newrows.index = [13, 14]
+    >>> newrows.to_sql('nbddata', engine, if_exists='append')
+    >>> len(loader.load().get_df())
+    15
+    >>> loader.stats['rows_added'], loader.stats['mark']
+    (2, 14)
+    >>> loader.stats['missing']['longitude']
+    1
+
+    A new loader reads the cached rows, and no rows from the database.
+
+    >>> loader = IncrementalLoader(engine, cachedir, nbdname='nbd',
+    ...                            watermark_col='index', index_col='index')
+    >>> len(loader.load().get_df()), loader.stats['rows_added']
+    (15, 0)
+
+    Part files are compacted after *max_parts* loads.
+
+    >>> import glob, os
+    >>> loader = IncrementalLoader(engine, cachedir, nbdname='nbd',
+    ...                            watermark_col='index', index_col='index',
+    ...                            max_parts=2)
+    >>> newrows.index = [15, 16]
+    >>> newrows.to_sql('nbddata', engine, if_exists='append')
+    >>> len(loader.load().get_df())
+    17
+    >>> [os.path.basename(part) for part in
+    ...  sorted(glob.glob(os.path.join(cachedir, '*.pkl')))]
+    ['nbddata-00003.pkl']
+
+    """
+
+    def __init__(self, engine, cachedir, tablename='nbddata',
+                 watermark_col='date', nbdname=None, latname='latitude',
+                 longname='longitude', datename='date', index_col=None,
+                 min_lat=minlat, max_lat=maxlat, min_long=minlong,
+                 max_long=maxlong, max_parts=10):
+
+        self.engine = engine
+        self.cachedir = cachedir
+        self.tablename = tablename
+        self.watermark_col = watermark_col
+        self.nbdname = nbdname
+        self.latname = latname
+        self.longname = longname
+        self.datename = datename
+        self.index_col = index_col
+        self.bounds = (min_lat, max_lat, min_long, max_long)
+        self.max_parts = max_parts
+
+        self.nbddf = None
+        """The loaded data, as an :class:`NBDDataFrame`."""
+
+        self.stats = None
+        """The statistics of the loaded data: the watermark *mark*, the
+        number of *rows*, the *rows_added* by the last load, the number of
+        rows *missing* each column and the number *out_of_bounds*."""
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def _statefile(self):
+        return os.path.join(self.cachedir, 'watermarks.json')
+
+    def _read_states(self):
+        if not os.path.exists(self._statefile()):
+            return {}
+        with open(self._statefile()) as f:
+            return json.load(f)
+
+    def _write_state(self, state):
+        states = self._read_states()
+        states[self.tablename] = state
+        tmpname = self._statefile() + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(states, f, indent=2, sort_keys=True)
+        os.rename(tmpname, self._statefile())
+
+    def _partfile(self, part):
+        return os.path.join(self.cachedir, part)
+
+    def _new_part(self, state, df):
+        #part names are never reused, so that a part written by a load
+        #interrupted before its state was written is not taken for a live
+        #one
+        number = state.get('next_part', 0)
+        part = '{}-{:05d}.pkl'.format(self.tablename, number)
+        df.to_pickle(self._partfile(part))
+        state['next_part'] = number + 1
+        state['parts'] = state.get('parts', []) + [part]
+
+    def _compact(self, state):
+        parts = state['parts']
+        df = pd.concat([pd.read_pickle(self._partfile(part))
+                        for part in parts])
+        state['parts'] = []
+        self._new_part(state, df)
+
+    def _remove_dead_parts(self, state):
+        pattern = os.path.join(self.cachedir,
+                               '{}-*.pkl'.format(self.tablename))
+        live = set(self._partfile(part) for part in state.get('parts', []))
+        for part in glob.glob(pattern):
+            if part not in live:
+                os.remove(part)
+
+    def _read_new_rows(self, mark):
+        from sqlalchemy import MetaData, Table, select
+
+        if mark is None:
+            query = self.tablename
+        else:
+            table = Table(self.tablename, MetaData(), autoload=True,
+                          autoload_with=self.engine)
+            column = table.c[self.watermark_col]
+            query = select([table]).where(column > mark)
+
+        df = pd.read_sql(query, con=self.engine,
+                         parse_dates=[self.datename],
+                         index_col=self.index_col)
+        if self.watermark_col == self.index_col:
+            marks = df.index
+        else:
+            marks = df[self.watermark_col]
+        newmark = marks.max() if len(df) > 0 else None
+
+        df.rename(columns={self.latname : 'latitude',
+                           self.longname : 'longitude',
+                           self.datename : 'date'}, inplace=True)
+        if self.nbdname:
+            df.rename(columns={self.nbdname : 'nbd'}, inplace=True)
+        return df, newmark
+
+    def _update_stats(self, state, df):
+        min_lat, max_lat, min_long, max_long = self.bounds
+        missing = state.setdefault('missing', {})
+        for col, count in (len(df) - df.count()).iteritems():
+            missing[col] = missing.get(col, 0) + int(count)
+        outofbounds = ((df.latitude < min_lat) | (df.latitude > max_lat) |
+                       (df.longitude < min_long) | (df.longitude > max_long))
+        state['out_of_bounds'] = (state.get('out_of_bounds', 0) +
+                                  int(outofbounds.sum()))
+        state['rows'] = state.get('rows', 0) + len(df)
+        state['rows_added'] = len(df)
+
+    def load(self):
+        """
+        Read the rows added to the table since the last load, append them
+        to the cached data and move the watermark.
+
+        Returns:
+        ________
+
+        :returns: all the loaded data
+        :rtype: :class:`NBDDataFrame`
+
+        """
+
+        state = self._read_states().get(self.tablename, {})
+        if state.get('watermark_col', self.watermark_col) != \
+                self.watermark_col:
+            raise Exception('Watermark column changed from {}'.format(
+                            state['watermark_col']))
+
+        #only the parts listed in the state are live: the state is written
+        #last, with an atomic rename, so an interrupted load leaves the
+        #previous parts and watermark
+        parts = state.get('parts', [])
+        if self.nbddf is None and parts:
+            df = pd.concat([pd.read_pickle(self._partfile(part))
+                            for part in parts])
+            min_lat, max_lat, min_long, max_long = self.bounds
+            self.nbddf = NBDDataFrame(df, min_lat=min_lat, max_lat=max_lat,
+                                      min_long=min_long, max_long=max_long)
+
+        mark = None
+        if self.nbddf is not None and 'mark' in state:
+            mark = _from_json_mark(state['mark'])
+
+        with instrument.stage('load', 'IncrementalLoader.load') as record:
+            newdf, newmark = self._read_new_rows(mark)
+            record.rows_out = len(newdf)
+
+        if self.index_col is None:
+            #keep the default index unique across loads
+            start = state.get('rows', 0) if mark is not None else 0
+            newdf.index = np.arange(start, start + len(newdf))
+
+        if mark is None:
+            state = {'watermark_col' : self.watermark_col,
+                     'next_part' : state.get('next_part', 0)}
+        if len(newdf) > 0:
+            self._new_part(state, newdf)
+            state['mark'] = _to_json_mark(newmark)
+            if len(state['parts']) > self.max_parts:
+                with instrument.stage('write', 'IncrementalLoader.compact',
+                                      state.get('rows', 0) + len(newdf)):
+                    self._compact(state)
+
+        if mark is None or self.nbddf is None:
+            min_lat, max_lat, min_long, max_long = self.bounds
+            self.nbddf = NBDDataFrame(newdf, min_lat=min_lat, max_lat=max_lat,
+                                      min_long=min_long, max_long=max_long)
+        else:
+            self.nbddf.append(newdf)
+
+        self._update_stats(state, newdf)
+        self._write_state(state)
+        self._remove_dead_parts(state)
+
+        self.stats = dict(state)
+        self.stats['mark'] = _from_json_mark(state['mark']) \
+            if 'mark' in state else None
+        return self.nbddf
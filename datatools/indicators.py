@@ -0,0 +1,358 @@
+"""
+A gentrification indicator engine: neighborhood by period panels of base
+metrics (row counts, value sums and means) and of indicators derived from
+them over rolling windows (rolling sums and means, growth rates and
+rolling z-scores).
+
+The engine keeps only the aggregated panel, and cumulative sums of it
+along the periods, from which every rolling window is one vectorized
+difference. New rows are aggregated on their own and added to the panel;
+the cumulative sums are only recomputed from the first period they touch.
+
+"""
+
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from panels import NBDPanel, join_panels
+
+
+transforms = ('rolling_sum', 'rolling_mean', 'growth', 'zscore')
+"""The supported ways to derive an indicator from a metric over a
+window of periods."""
+
+
+def _windows(cums, window, end_offset=0):
+    """
+    Get the sums over the windows of *window* periods ending *end_offset*
+    periods before each period, from the cumulative sums *cums* (with a
+    leading zero period). Incomplete windows are NaN.
+
+    """
+
+    num_periods = cums.shape[1] - 1
+    hi = np.arange(num_periods) + 1 - end_offset
+    lo = hi - window
+    valid = lo >= 0
+    sums = cums[:, np.clip(hi, 0, None)] - cums[:, np.clip(lo, 0, None)]
+    sums[:, ~valid] = np.nan
+    return sums
+
+
+class IndicatorEngine(object):
+    """
+    An indicator engine, fed with rows of neighborhood data by
+    :meth:`update`.
+
+    Parameters:
+    ___________
+
+    :param list metrics:
+        the base metrics, as a list of tuples *(column, how)* or
+        *(column, how, name)* as in :func:`~datatools.panels.join_panels`
+
+    :param list indicators:
+        (optional) the derived indicators, as a list of tuples
+        *(name, metric, transform, window)*: *metric* is the name of a
+        base metric, *transform* is one of :attr:`transforms` and *window*
+        is a number of periods; default is no indicators
+
+    :param str freq:
+        the period frequency, default is 'M' (monthly)
+
+    The indicators of a metric *x* at period *t*, over a window *w*, are
+
+    - *rolling_sum*: the sum of *x* over the periods *t - w + 1* to *t*,
+    - *rolling_mean*: the mean of *x* over the periods of the same window
+      where it is not missing,
+    - *growth*: the relative change of *x* since the period *t - w*,
+    - *zscore*: the distance of *x* from its mean over the *w* periods
+      before *t*, in standard deviations of *x* over those periods.
+
+    Windows reaching before the first period, and z-scores of windows
+    with no variation, are NaN.
+
+    For example, we count rows and average *val* by neighborhood and year,
+    with 2-year rolling sums of the counts and yearly growth.
+
+    >>> import numpy as np
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.indicators import IndicatorEngine
+    >>> engine = IndicatorEngine([(None, 'count'), ('val', 'mean')],
+    ...                          [('count_2y', 'count', 'rolling_sum', 2),
+    ...                           ('count_growth', 'count', 'growth', 1)],
+    ...                          freq='A')
+    >>> df = get_testdataframe()
+    >>> engine.update(NBDDataFrame(df.iloc[:8]))
+    >>> panel = engine.panel()
+    >>> panel.metrics
+    ['count', 'val_mean', 'count_2y', 'count_growth']
+    >>> panel.get_metric('count_2y')[:, :4]
+    array([[nan,  2.,  0.,  0.],
+           [nan,  1.,  1.,  0.]])
+
+    The engine can be saved, and later rows added to its panel.
+
+    >>> engine.save('test_indicators.pkl')
+    >>> engine = IndicatorEngine.load('test_indicators.pkl')
+    >>> engine.update(NBDDataFrame(df.iloc[8:]))
+    >>> full = IndicatorEngine([(None, 'count'), ('val', 'mean')],
+    ...                        [('count_2y', 'count', 'rolling_sum', 2),
+    ...                         ('count_growth', 'count', 'growth', 1)],
+    ...                        freq='A')
+    >>> full.update(NBDDataFrame(df))
+    >>> np.allclose(engine.panel().values, full.panel().values,
+    ...             equal_nan=True)
+    True
+
+    Later rows may start after a gap of periods with no rows.
+
+    >>> engine = IndicatorEngine([(None, 'count'), ('val', 'mean')],
+    ...                          [('count_3y', 'count', 'rolling_sum', 3)],
+    ...                          freq='A')
+    >>> dated = df.sort_values('date')
+    >>> engine.update(NBDDataFrame(dated[dated['date'].dt.year < 2000]))
+    >>> engine.update(NBDDataFrame(dated[dated['date'].dt.year == 2000]))
+    >>> full = IndicatorEngine([(None, 'count'), ('val', 'mean')],
+    ...                        [('count_3y', 'count', 'rolling_sum', 3)],
+    ...                        freq='A')
+    >>> full.update(NBDDataFrame(df))
+    >>> np.allclose(engine.panel().values, full.panel().values,
+    ...             equal_nan=True)
+    True
+    >>> engine.panel().get_metric('count_3y')[1, :5]
+    array([nan, nan,  3.,  3.,  0.])
+
+    """
+
+    def __init__(self, metrics, indicators=(), freq='M'):
+
+        self.freq = freq
+        self.metrics = []
+        #the metrics aggregated from the rows: the count of each metric,
+        #and the sum of each sum or mean metric
+        self._parts = []
+        for spec in metrics:
+            column, how = spec[:2]
+            if len(spec) > 2:
+                name = spec[2]
+            elif column is None:
+                name = how
+            else:
+                name = '{}_{}'.format(column, how)
+            self.metrics.append((name, column, how))
+            self._parts.append((column, 'count'))
+            if how != 'count':
+                self._parts.append((column, 'sum'))
+
+        names = [name for name, column, how in self.metrics]
+        self.indicators = list(indicators)
+        for name, metric, transform, window in self.indicators:
+            if metric not in names:
+                raise Exception('Unknown metric {}'.format(metric))
+            if transform not in transforms:
+                raise Exception('Unsupported transform {}'.format(transform))
+            if window < 1:
+                raise Exception('Window must be at least 1 period')
+
+        self.nbds = []
+        """The neighborhoods of the panel, sorted."""
+
+        self.first = None
+        """The ordinal of the first period of the panel."""
+
+        #the aggregated parts, by neighborhood, period and part
+        self._totals = np.zeros((0, 0, len(self._parts)))
+        #the metric values, and the cumulative sums along the periods (with
+        #a leading zero period) of the number of values that are not
+        #missing, of the values and of their squares
+        self._values = np.zeros((0, 0, len(self.metrics)))
+        self._cums = np.zeros((3, 0, 1, len(self.metrics)))
+        self._panel = None
+
+    def periods(self):
+        """
+        Get the periods of the panel.
+
+        :rtype: pandas.PeriodIndex
+
+        """
+
+        num_periods = self._totals.shape[1]
+        if num_periods == 0:
+            return pd.PeriodIndex([], freq=self.freq)
+        return pd.period_range(start=pd.Period(ordinal=self.first,
+                                               freq=self.freq),
+                               periods=num_periods, freq=self.freq)
+
+    def update(self, nbddf):
+        """
+        Add the rows of *nbddf* (rows not added before) to the panel.
+
+        :param nbddf: the rows, as an
+            :class:`~datatools.nbddataframe.NBDDataFrame` with an *nbd*
+            column
+
+        """
+
+        with instrument.stage('aggregate', 'IndicatorEngine.update',
+                              rows_in=len(nbddf.get_df())):
+            new = join_panels([(nbddf, column, how)
+                               for column, how in self._parts],
+                              freq=self.freq)
+            if len(new.periods) == 0 or len(new.nbds) == 0:
+                return
+            newfirst = new.periods[0].ordinal
+            p0 = self._grow(new.nbds, newfirst, len(new.periods))
+
+            rows = np.searchsorted(self.nbds, new.nbds)
+            cols = np.arange(len(new.periods)) + newfirst - self.first
+            self._totals[rows[:, None], cols] += new.values
+            self._recompute(p0)
+            self._panel = None
+
+    def _grow(self, nbds, first, num_periods):
+        """
+        Grow the panel to hold the neighborhoods *nbds* and *num_periods*
+        periods from the ordinal *first*, and get the index of the first
+        period to recompute.
+
+        """
+
+        old_nbds = self.nbds
+        old_first = first if self.first is None else self.first
+        old_periods = self._totals.shape[1]
+        all_nbds = sorted(set(old_nbds) | set(nbds))
+        start = min(old_first, first)
+        end = max(old_first + old_periods, first + num_periods)
+
+        if all_nbds != old_nbds or start != old_first or \
+                end != old_first + old_periods:
+            shift = old_first - start
+            rows = np.searchsorted(all_nbds, old_nbds)
+            shape = (len(all_nbds), end - start)
+            totals = np.zeros(shape + (len(self._parts),))
+            totals[rows, shift:shift + old_periods] = self._totals
+            values = np.zeros(shape + (len(self.metrics),))
+            values[rows, shift:shift + old_periods] = self._values
+            cums = np.zeros((3, shape[0], shape[1] + 1, len(self.metrics)))
+            cums[:, rows, shift:shift + old_periods + 1] = self._cums
+            self._totals, self._values, self._cums = totals, values, cums
+            self.nbds = all_nbds
+            self.first = start
+            if shift > 0 or len(all_nbds) != len(old_nbds):
+                #earlier periods or new neighborhoods: start over
+                return 0
+        #periods between the old end and the new rows carry the totals over
+        return min(first - self.first, old_periods)
+
+    def _recompute(self, p0):
+        """
+        Recompute the metric values and their cumulative sums from the
+        period index *p0* on.
+
+        """
+
+        totals = self._totals[:, p0:]
+        for m, (name, column, how) in enumerate(self.metrics):
+            counts = totals[:, :, self._parts.index((column, 'count'))]
+            if how == 'count':
+                values = counts
+            else:
+                values = totals[:, :, self._parts.index((column, 'sum'))]
+                if how == 'mean':
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        values = np.where(counts > 0, values / counts,
+                                          np.nan)
+            self._values[:, p0:, m] = values
+
+        values = self._values[:, p0:]
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.)
+        for c, increments in enumerate([present, filled, filled ** 2]):
+            self._cums[c, :, p0 + 1:] = self._cums[c, :, p0:p0 + 1] + \
+                np.cumsum(increments, axis=1)
+
+    def _indicator(self, metric, transform, window):
+        m = [name for name, column, how in self.metrics].index(metric)
+        values = self._values[:, :, m]
+        present, sums, squares = [cums[:, :, m] for cums in self._cums]
+
+        if transform == 'rolling_sum':
+            return _windows(sums, window)
+        if transform == 'rolling_mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return _windows(sums, window) / _windows(present, window)
+        if transform == 'growth':
+            before = np.full(values.shape, np.nan)
+            before[:, window:] = values[:, :-window]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                growth = (values - before) / before
+            growth[~np.isfinite(growth)] = np.nan
+            return growth
+
+        #rolling z-score against the window before each period
+        n = _windows(present, window, end_offset=1)
+        s = _windows(sums, window, end_offset=1)
+        q = _windows(squares, window, end_offset=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s / n
+            deviations = q - s * mean
+            zscore = (values - mean) / np.sqrt(deviations / (n - 1))
+            #no variation, up to the rounding errors of the cumulative sums
+            flat = deviations <= 1e-10 * squares[:, :-1]
+            zscore[~np.isfinite(zscore) | flat | (n < 2)] = np.nan
+        return zscore
+
+    def panel(self):
+        """
+        Get the panel of the base metrics and the indicators. It is cached
+        until the next :meth:`update`.
+
+        Returns:
+        ________
+
+        :returns: the panel
+        :rtype: :class:`~datatools.panels.NBDPanel`
+
+        """
+
+        if self._panel is None:
+            with instrument.stage('aggregate', 'IndicatorEngine.panel'):
+                names = [name for name, column, how in self.metrics]
+                arrays = [self._values[:, :, m] for m in range(len(names))]
+                for name, metric, transform, window in self.indicators:
+                    names.append(name)
+                    arrays.append(self._indicator(metric, transform, window))
+                if arrays:
+                    values = np.dstack(arrays)
+                else:
+                    values = np.zeros(self._values.shape)
+                self._panel = NBDPanel(values, list(self.nbds),
+                                       self.periods(), names)
+        return self._panel
+
+    def save(self, filename):
+        """
+        Save the engine to the file *filename*, to be loaded by
+        :meth:`load` and updated with later rows.
+
+        """
+
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename):
+        """
+        Load an engine saved by :meth:`save`.
+
+        :rtype: :class:`IndicatorEngine`
+
+        """
+
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
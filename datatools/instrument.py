@@ -0,0 +1,324 @@
+"""
+Lightweight instrumentation of the stages (load, rename, clean, write,
+aggregate, fit, predict, plot) of :mod:`datatools` and :mod:`nbdtools`: for
+each stage run, the wall time, rows in and out and peak memory are
+recorded, passed to any registered callbacks, and available as a report.
+
+For example,
+
+>>> from datatools import instrument
+>>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+>>> testdataframe = get_testdataframe()
+>>> instrument.reset()
+>>> seen = []
+>>> callback = lambda record: seen.append(record['name'])
+>>> instrument.add_callback(callback)
+>>> nbddf = NBDDataFrame(testdataframe)
+>>> nbddf.remove_missing_data()
+>>> nbddf.remove_outofbounds_data()
+>>> seen
+['remove_missing_data', 'remove_outofbounds_data']
+>>> report = instrument.report()
+>>> report[['stage', 'name', 'runs', 'rows_in', 'rows_out']]
+   stage                     name  runs  rows_in  rows_out
+0  clean      remove_missing_data     1       13        12
+1  clean  remove_outofbounds_data     1       12        10
+>>> instrument.remove_callback(callback)
+True
+>>> instrument.reset()
+
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+import warnings
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss():
+    """
+    Get the resident memory of this process in bytes (Linux only; 0
+    elsewhere).
+
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def max_rss():
+    """
+    Get the peak resident memory of this process so far in bytes (0 if
+    unknown).
+
+    """
+
+    if resource is None:
+        return 0
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemorySampler(object):
+    """
+    Sample the resident memory of this process in a background thread
+    and keep the peak.
+
+    :param float interval:
+        the sampling interval in seconds, default is 0.005
+
+    """
+
+    def __init__(self, interval=0.005):
+
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class StageRecord(object):
+    """
+    The measurements of one run of a stage. The code running the stage
+    sets *rows_out* (and *rows_in*, if it was not known at the start).
+
+    """
+
+    def __init__(self, stage, name, rows_in=None):
+
+        self.stage = stage
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.start = None
+        self.seconds = None
+        self.rss_start_mb = None
+        self.peak_mem_mb = None
+        self.error = None
+
+    def as_dict(self):
+        """
+        Get the record as a dict.
+
+        """
+
+        return dict(self.__dict__)
+
+
+class Instrumentation(object):
+    """
+    A recorder of stage runs.
+
+    Parameters:
+    ___________
+
+    :param int max_records:
+        the number of most recent records kept, default is 10000
+
+    :param bool sample_memory:
+        if True, sample memory in a background thread during each stage
+        for an exact peak; otherwise the peak is the largest of the
+        memory at the start and end of the stage and, if the process
+        peak grew during the stage, that new peak; default is False
+
+    """
+
+    def __init__(self, max_records=10000, sample_memory=False):
+
+        self.enabled = True
+        self.sample_memory = sample_memory
+        self.callbacks = []
+        self._records = collections.deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """
+        Call *callback* with the dict of each record when its stage ends.
+        An exception raised by *callback* is turned into a warning.
+
+        """
+
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """
+        Stop calling *callback*.
+
+        :returns: True if *callback* was registered
+        :rtype: bool
+
+        """
+
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+            return True
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, stage, name, rows_in=None):
+        """
+        Record the run of the code in the with block as stage *stage*
+        (e.g. 'clean') of function *name* (e.g. 'remove_missing_data').
+
+        :returns: a context manager yielding the :class:`StageRecord`
+
+        """
+
+        record = StageRecord(stage, name, rows_in)
+        if not self.enabled:
+            yield record
+            return
+
+        sampler = PeakMemorySampler() if self.sample_memory else None
+        rss_start = current_rss()
+        maxrss_start = max_rss()
+        if sampler is not None:
+            sampler.__enter__()
+        record.start = time.time()
+        try:
+            yield record
+        except Exception as e:
+            record.error = '{}: {}'.format(type(e).__name__, e)
+            raise
+        finally:
+            record.seconds = time.time() - record.start
+            if sampler is not None:
+                sampler.__exit__()
+                peak = sampler.peak
+            else:
+                peak = max(rss_start, current_rss())
+                maxrss_end = max_rss()
+                if maxrss_end > maxrss_start:
+                    peak = max(peak, maxrss_end)
+            record.rss_start_mb = rss_start / 2.0 ** 20
+            record.peak_mem_mb = peak / 2.0 ** 20
+            self._finish(record)
+
+    def _finish(self, record):
+        recorddict = record.as_dict()
+        with self._lock:
+            self._records.append(recorddict)
+        for callback in list(self.callbacks):
+            #a failing callback must not hide the error of the stage, nor
+            #keep the other callbacks from running
+            try:
+                callback(recorddict)
+            except Exception as e:
+                warnings.warn('Instrumentation callback {!r} failed: '
+                              '{}: {}'.format(callback, type(e).__name__, e),
+                              RuntimeWarning)
+
+    def records(self):
+        """
+        Get the kept records, oldest first.
+
+        :returns: the records as dicts
+        :rtype: list
+
+        """
+
+        with self._lock:
+            return list(self._records)
+
+    def report(self):
+        """
+        Summarize the kept records by stage and function: the number of
+        runs, total and largest time in seconds, total rows in and out
+        and largest peak memory in MB.
+
+        :returns: the summary, in order of first run
+        :rtype: pandas.DataFrame
+
+        """
+
+        import pandas as pd
+
+        columns = ['stage', 'name', 'runs', 'seconds', 'max_seconds',
+                   'rows_in', 'rows_out', 'peak_mem_mb']
+        records = self.records()
+        if not records:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.DataFrame(records)
+        df['order'] = range(len(df))
+        grouped = df.groupby(['stage', 'name'])
+        summary = pd.DataFrame({
+            'runs' : grouped.size(),
+            'seconds' : grouped.seconds.sum(),
+            'max_seconds' : grouped.seconds.max(),
+            'rows_in' : grouped.rows_in.sum(),
+            'rows_out' : grouped.rows_out.sum(),
+            'peak_mem_mb' : grouped.peak_mem_mb.max(),
+            'order' : grouped.order.min(),
+        })
+        summary = summary.sort_values('order').reset_index()
+        return summary[columns]
+
+    def reset(self):
+        """
+        Forget the kept records.
+
+        """
+
+        with self._lock:
+            self._records.clear()
+
+
+instrumentation = Instrumentation()
+"""The instrumentation used by :mod:`datatools` and :mod:`nbdtools`."""
+
+
+def stage(stage, name, rows_in=None):
+    """See :meth:`Instrumentation.stage`."""
+    return instrumentation.stage(stage, name, rows_in)
+
+
+def add_callback(callback):
+    """See :meth:`Instrumentation.add_callback`."""
+    instrumentation.add_callback(callback)
+
+
+def remove_callback(callback):
+    """See :meth:`Instrumentation.remove_callback`."""
+    return instrumentation.remove_callback(callback)
+
+
+def records():
+    """See :meth:`Instrumentation.records`."""
+    return instrumentation.records()
+
+
+def report():
+    """See :meth:`Instrumentation.report`."""
+    return instrumentation.report()
+
+
+def reset():
+    """See :meth:`Instrumentation.reset`."""
+    instrumentation.reset()
@@ -0,0 +1,280 @@
+"""
+An import ledger: a record, kept in the database next to the imported
+data, of the content hash of each imported source file and of each
+imported row, so that reimporting an export only inserts the new rows and
+updates the changed ones.
+
+A file whose size and modification time have not changed since its last
+import is skipped without being read. Rows are identified by a key made
+from identifying columns (e.g. name and address), normalized so that
+changes in case and spacing do not make a new row.
+
+"""
+
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+
+def file_digest(filename, blocksize=2 ** 20):
+    """
+    Get the SHA-1 hex digest of the content of the file *filename*.
+
+    """
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_value(value):
+    """
+    Normalize an identifying value: lower case, with runs of whitespace
+    replaced by one space and surrounding whitespace removed.
+
+    For example,
+
+    >>> from datatools.ledger import normalize_value
+    >>> normalize_value(u'  826 Seattle\\n8414 Greenwood Ave ')
+    u'826 seattle 8414 greenwood ave'
+    >>> normalize_value(None)
+    u''
+
+    """
+
+    if value is None:
+        return u''
+    return re.sub(r'\s+', u' ', unicode(value)).strip().lower()
+
+
+def _digest(values):
+    joined = u'\x1f'.join(u'' if v is None else unicode(v) for v in values)
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()
+
+
+def row_key(row, keys):
+    """
+    Get the key of the row *row* (a dict): the digest of its normalized
+    values of the columns *keys*.
+
+    For example,
+
+    >>> from datatools.ledger import row_key
+    >>> row_key({'name' : 'Artist Trust', 'seats' : 1}, ['name']) == \\
+    ...     row_key({'name' : ' artist  TRUST', 'seats' : 2}, ['name'])
+    True
+
+    """
+
+    return _digest([normalize_value(row.get(key)) for key in keys])
+
+
+def row_digest(row, columns):
+    """
+    Get the digest of the values of the columns *columns* of the row *row*
+    (a dict), as they are.
+
+    """
+
+    return _digest([row.get(col) for col in columns])
+
+
+def _mtime_ns(stat):
+    return int(round(stat.st_mtime * 1e9))
+
+
+class ImportLedger(object):
+    """
+    The import ledger of the database *engine*, kept in the tables
+    *filetable* (one row per source file and data table) and *rowtable*
+    (one row per data table and row key), which are created on first use.
+
+    For example, a file is imported into the table 'culture' once.
+
+    >>> from sqlalchemy import create_engine
+    >>> from datatools.ledger import ImportLedger
+    >>> fil = open('test_ledger.csv', 'w')
+    >>> fil.write('Name\\nA\\n')
+    >>> fil.close()
+    >>> ledger = ImportLedger(create_engine('sqlite://'))
+    >>> digest = ledger.file_changed('test_ledger.csv', 'culture')
+    >>> digest
+    '4e2a273059a5d952b37810f3ef520fcaf87a1b57'
+    >>> ledger.record_file('test_ledger.csv', 'culture', rows=1,
+    ...                    digest=digest)
+    >>> ledger.file_changed('test_ledger.csv', 'culture') is None
+    True
+
+    A row is new, unchanged or changed according to its recorded digest.
+
+    >>> digests = ledger.row_digests('culture', ['k1'])
+    >>> ledger.record_rows('culture', [('k1', 'd1')], digests)
+    >>> ledger.record_rows('culture', [('k1', 'd2')], digests)
+    >>> ledger.row_digests('culture', ['k1', 'k2'])
+    {u'k1': u'd2'}
+
+    """
+
+    def __init__(self, engine, filetable='import_files',
+                 rowtable='import_rows'):
+        self.engine = engine
+        self.filetable = filetable
+        self.rowtable = rowtable
+        self._tables = None
+
+    def tables(self):
+        """
+        Get the ledger tables, creating them if they do not exist.
+
+        :returns: the file table and the row table
+        :rtype: sqlalchemy.Table, sqlalchemy.Table
+
+        """
+
+        if self._tables is None:
+            from sqlalchemy import (MetaData, Table, Column, String, Integer,
+                                    BigInteger, DateTime)
+
+            metadata = MetaData()
+            files = Table(self.filetable, metadata,
+                          Column('source', String(255), primary_key=True),
+                          Column('tablename', String(255), primary_key=True),
+                          Column('size', BigInteger),
+                          #nanoseconds, exact in every database, where a
+                          #Float may be single precision (e.g. MySQL)
+                          Column('mtime_ns', BigInteger),
+                          Column('digest', String(40)),
+                          Column('rows', Integer),
+                          Column('imported_at', DateTime))
+            rows = Table(self.rowtable, metadata,
+                         Column('tablename', String(255), primary_key=True),
+                         Column('row_key', String(40), primary_key=True),
+                         Column('digest', String(40)))
+            metadata.create_all(self.engine)
+            self._tables = files, rows
+        return self._tables
+
+    def _file_entry(self, filename, tablename):
+        files = self.tables()[0]
+        query = files.select().where(
+            (files.c.source == os.path.abspath(filename)) &
+            (files.c.tablename == tablename))
+        with self.engine.connect() as con:
+            return con.execute(query).fetchone()
+
+    def file_changed(self, filename, tablename):
+        """
+        Check whether the file *filename* changed since it was last
+        imported into the table *tablename*. If its size and modification
+        time are as recorded, it did not change and it is not read; if
+        only they changed, its digest is compared to the recorded one.
+
+        :returns: the digest of the file if it changed, to pass to
+            :meth:`record_file` after its import, or None
+        :rtype: str
+
+        """
+
+        entry = self._file_entry(filename, tablename)
+        stat = os.stat(filename)
+        if entry is not None and entry['size'] == stat.st_size and \
+                entry['mtime_ns'] == _mtime_ns(stat):
+            return None
+        digest = file_digest(filename)
+        if entry is None or entry['digest'] != digest:
+            return digest
+
+        #touched but not changed: record the new time, to skip the digest
+        #next time
+        self.record_file(filename, tablename, rows=entry['rows'],
+                         digest=entry['digest'])
+        return None
+
+    def record_file(self, filename, tablename, rows, digest=None):
+        """
+        Record the import of the file *filename* (with *rows* rows) into
+        the table *tablename*. The file is hashed if *digest* is None.
+
+        """
+
+        files = self.tables()[0]
+        stat = os.stat(filename)
+        values = {'size' : stat.st_size, 'mtime_ns' : _mtime_ns(stat),
+                  'digest' : digest or file_digest(filename), 'rows' : rows,
+                  'imported_at' : datetime.now()}
+        source = os.path.abspath(filename)
+        exists = self._file_entry(filename, tablename) is not None
+        with self.engine.begin() as con:
+            if exists:
+                con.execute(files.update().where(
+                    (files.c.source == source) &
+                    (files.c.tablename == tablename)).values(**values))
+            else:
+                con.execute(files.insert().values(source=source,
+                                                  tablename=tablename,
+                                                  **values))
+
+    def row_digests(self, tablename, keys, chunksize=500):
+        """
+        Get the recorded row digests of the row keys *keys* (e.g. of a
+        batch of rows) of the table *tablename*, querying *chunksize* keys
+        at a time.
+
+        :returns: the digests, by row key, of the keys that are recorded
+        :rtype: dict
+
+        """
+
+        rows = self.tables()[1]
+        keys = list(set(keys))
+        digests = {}
+        with self.engine.connect() as con:
+            for start in range(0, len(keys), chunksize):
+                query = rows.select().where(
+                    (rows.c.tablename == tablename) &
+                    rows.c.row_key.in_(keys[start:start + chunksize]))
+                digests.update((row['row_key'], row['digest'])
+                               for row in con.execute(query))
+        return digests
+
+    def record_rows(self, tablename, keydigests, digests, con=None):
+        """
+        Record the digests of imported rows of the table *tablename*.
+
+        :param list keydigests: the (row key, digest) tuples to record
+        :param dict digests:
+            the recorded digests of (at least) the keys of *keydigests*,
+            as returned by :meth:`row_digests`; it is updated
+        :param con:
+            (optional) the connection to use, e.g. to record the rows in
+            the transaction that imports them, default is None
+
+        """
+
+        rows = self.tables()[1]
+        #the last digest of a key recorded twice wins
+        keydigests = OrderedDict(keydigests).items()
+        inserts = [{'tablename' : tablename, 'row_key' : key, 'digest' : d}
+                   for key, d in keydigests if key not in digests]
+        updates = [{'b_key' : key, 'digest' : d}
+                   for key, d in keydigests if key in digests]
+        if con is None:
+            with self.engine.begin() as con:
+                self._write_rows(con, rows, tablename, inserts, updates)
+        else:
+            self._write_rows(con, rows, tablename, inserts, updates)
+        digests.update(keydigests)
+
+    def _write_rows(self, con, rows, tablename, inserts, updates):
+        from sqlalchemy import bindparam
+
+        if inserts:
+            con.execute(rows.insert(), inserts)
+        if updates:
+            con.execute(rows.update().where(
+                (rows.c.tablename == tablename) &
+                (rows.c.row_key == bindparam('b_key'))), updates)
@@ -1,10 +1,15 @@
 import pandas as pd
-from sqlalchemy import create_engine, MetaData
 from StringIO import StringIO
-from mpl_toolkits.basemap import Basemap
-import matplotlib.pyplot as plt
+import numpy as np
+from spatial import build_tree, query_tree
+from projection import bounds_origin, to_planar
+from density import density_surfaces
+from parallelcsv import read_csv_parallel
+from render import new_figure, draw_rowcount_by_month, draw_map, render_batch
+import instrument
 
-pd.options.display.mpl_style = 'default'
+#matplotlib, Basemap and sqlalchemy are slow to import, so they are
+#imported on first use
 
 
 #data string for testing purposes
@@ -39,8 +44,65 @@ minlong = -122.44
 maxlong = -122.2
 """The default maximum longitude."""
 
+_location_pattern = (r'^\s*\(?\s*([-+]?\d+(?:\.\d*)?)\s*,'
+                     r'\s*([-+]?\d+(?:\.\d*)?)\s*\)?\s*$')
+
+
+def parse_location(location):
+    """
+    Parse a column of combined locations such as "(47.6091917, 
+    -122.3345412)" into latitudes and longitudes, in one vectorized pass.
+    
+    Parameters:
+    ___________
+    
+    :param pandas.Series location:
+        the locations, as strings
+        
+    Returns:
+    ________
+    
+    :return: a DataFrame with float *latitude* and *longitude* columns, 
+        missing where the location is missing or cannot be parsed
+    :rtype: pandas.DataFrame
+    
+    For example,
+    
+    >>> import pandas as pd
+    >>> from datatools.nbddataframe import parse_location
+    >>> parse_location(pd.Series(['(47.6091917, -122.3345412)', '', 
+    ...                           'unknown', None, '47.5,-122.3']))
+        latitude   longitude
+    0  47.609192 -122.334541
+    1        NaN         NaN
+    2        NaN         NaN
+    3        NaN         NaN
+    4  47.500000 -122.300000
+    
+    """
+    
+    if location.dtype != object:
+        location = location.astype(object)
+    parsed = location.str.extract(_location_pattern).astype(float)
+    parsed.columns = ['latitude', 'longitude']
+    return parsed
+
+
+def _set_location(df, locname):
+    """
+    Replace the combined location column *locname* of *df* by *latitude*
+    and *longitude* columns.
+    
+    """
+    
+    parsed = parse_location(df[locname])
+    del df[locname]
+    df['latitude'] = parsed['latitude']
+    df['longitude'] = parsed['longitude']
+    
+
 def rename_cols(df, nbdname=None, latname='latitude',
-                longname='longitude', datename='date'):
+                longname='longitude', datename='date', locname=None):
     """
     Rename the longitude, latitude, date (and convert to time type)
     and nbd (if there is one) columns to make the DataFrame *df* 
@@ -61,6 +123,12 @@ def rename_cols(df, nbdname=None, latname='latitude',
     
     :param str datename: 
         the name of the date column, default is 'date'
+    
+    :param str locname:
+        (optional) the name of a combined location column such as
+        "(47.6091917, -122.3345412)": if given, it is parsed by 
+        :func:`parse_location` into the latitude and longitude columns
+        instead, default is None
         
     Returns:
     ________
@@ -70,25 +138,34 @@ def rename_cols(df, nbdname=None, latname='latitude',
 
     """     
     
-    newdf = df.rename(columns={latname:'latitude', longname:'longitude',
-                       datename:'date'})
-    if nbdname:
-        newdf.rename(columns={nbdname:'nbd'}, inplace=True)
-    
-    newdf['date'] = pd.to_datetime(newdf['date'])    
+    with instrument.stage('rename', 'rename_cols', len(df)) as record:
+        if locname:
+            newdf = df.rename(columns={datename:'date'})
+            _set_location(newdf, locname)
+        else:
+            newdf = df.rename(columns={latname:'latitude', 
+                                       longname:'longitude', 
+                                       datename:'date'})
+        if nbdname:
+            newdf.rename(columns={nbdname:'nbd'}, inplace=True)
+        
+        newdf['date'] = pd.to_datetime(newdf['date'])    
+        record.rows_out = len(newdf)
            
     return newdf
     
 
 
 def get_csv_data(filename, nbdname=None, latname='latitude',
-                 longname='longitude', datename='date', sep='\t'):
+                 longname='longitude', datename='date', sep='\t',
+                 locname=None, nprocs=None):
     """
     Read neighborhood data from a csv into a pandas.DataFrame
     compatible with :class:`NBDDataFrame`. The csv data should have at
     the least latitude and longitude columns with names *latname* and
-    *longname*, and a date column with name *datename*. A neighborhood
-    column with name *nbdname* is optional.
+    *longname* (or a combined location column with name *locname*), and a
+    date column with name *datename*. A neighborhood column with name 
+    *nbdname* is optional.
     
     Parameters:
     ___________
@@ -112,6 +189,17 @@ def get_csv_data(filename, nbdname=None, latname='latitude',
     :param str sep: 
         the separation character, default is tab
     
+    :param str locname:
+        (optional) the name of a combined location column such as
+        "(47.6091917, -122.3345412)": if given, it is parsed by 
+        :func:`parse_location` into the latitude and longitude columns
+        instead, default is None
+    
+    :param int nprocs:
+        (optional) if more than 1, the file is parsed in this many 
+        processes by :func:`datatools.parallelcsv.read_csv_parallel`,
+        default is None
+    
     Returns:
     ________
     
@@ -127,7 +215,7 @@ def get_csv_data(filename, nbdname=None, latname='latitude',
     >>> df = get_csv_data(
     ...                   filename='test.csv', nbdname='neighborhood',
     ...                   latname='lat', longname='lon', datename='date', 
-    ...                   sep='\t'
+    ...                   sep='\\t'
     ... )
     >>> df.head()
             val   latitude   longitude      rand nbd       date
@@ -140,23 +228,65 @@ def get_csv_data(filename, nbdname=None, latname='latitude',
     'B'
     >>> df.mean().loc['latitude']
     47.597802519907695
+    
+    The cultural spaces export has a combined location column.
+    
+    >>> culture = get_csv_data('culture.csv', nbdname='Neighborhood',
+    ...                        datename='Year of Occupation', sep=',',
+    ...                        locname='Location')
+    >>> culture[['nbd', 'date', 'latitude', 'longitude']].head(2)
+                nbd       date   latitude   longitude
+    0      Downtown 2001-01-01  47.609192 -122.334541
+    1  Capitol Hill 2001-01-01  47.618569 -122.317249
         
     """
 
-    df = pd.read_csv(filename, sep='\t', parse_dates=[datename])
-    df.rename(columns={latname:'latitude', longname:'longitude',
-                       datename:'date'}, inplace=True)
-    if nbdname:
-        df.rename(columns={nbdname:'nbd'}, inplace=True)
+    with instrument.stage('load', 'get_csv_data') as record:
+        if nprocs > 1:
+            df = read_csv_parallel(filename, nprocs=nprocs, sep=sep, 
+                                   parse_dates=[datename])
+        else:
+            df = pd.read_csv(filename, sep=sep, parse_dates=[datename])
+        if locname:
+            df.rename(columns={datename:'date'}, inplace=True)
+            _set_location(df, locname)
+        else:
+            df.rename(columns={latname:'latitude', longname:'longitude',
+                               datename:'date'}, inplace=True)
+        if nbdname:
+            df.rename(columns={nbdname:'nbd'}, inplace=True)
+        record.rows_out = len(df)
     
     return df
     
     
-#test dataframe
-testdataframe = get_csv_data(
-                  filename=StringIO(testdata), nbdname='neighborhood',
-                  latname='lat', longname='lon', datename='date', sep='\t'
-)
+_testdataframe = None
+
+
+def get_testdataframe():
+    """
+    Get :attr:`testdata` as a DataFrame compatible with 
+    :class:`NBDDataFrame`. The data is parsed on the first call only.
+    
+    This replaces the module attribute ``testdataframe``, which parsed
+    the data on import: use ``get_testdataframe()`` in its place.
+    
+    Returns:
+    ________
+    
+    :return: the test DataFrame
+    :rtype: pandas.DataFrame
+    
+    """
+    
+    global _testdataframe
+    if _testdataframe is None:
+        _testdataframe = get_csv_data(
+                          filename=StringIO(testdata), nbdname='neighborhood',
+                          latname='lat', longname='lon', datename='date', 
+                          sep='\t'
+        )
+    return _testdataframe
 
 
 def get_db_data(engine, tablename='nbddata', nbdname=None, 
@@ -202,9 +332,9 @@ def get_db_data(engine, tablename='nbddata', nbdname=None,
     
     For example,
 
-    >>> from datatools.nbddataframe import testdataframe, NBDDataFrame
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
     >>> from datatools.nbddataframe import make_db, get_db_data
-    >>> neigh_dataframe = NBDDataFrame(testdataframe)
+    >>> neigh_dataframe = NBDDataFrame(get_testdataframe())
     >>> engine = make_db(nbddf=neigh_dataframe, tablename='neigh_data')
     >>> df2 = get_db_data(engine=engine, tablename='neigh_data', 
     ...                   nbdname='nbd', latname='latitude', 
@@ -215,12 +345,15 @@ def get_db_data(engine, tablename='nbddata', nbdname=None,
     
     """
         
-    df = pd.read_sql_table(table_name=tablename, con=engine,
-                           parse_dates=[datename], index_col=index_col)
-    colrndict = {latname:'latitude', longname:'longitude', datename:'date'}
-    df.rename(columns=colrndict, inplace=True)
-    if nbdname:
-        df.rename(columns={nbdname:'nbd'}, inplace=True)
+    with instrument.stage('load', 'get_db_data') as record:
+        df = pd.read_sql_table(table_name=tablename, con=engine,
+                               parse_dates=[datename], index_col=index_col)
+        colrndict = {latname:'latitude', longname:'longitude', 
+                     datename:'date'}
+        df.rename(columns=colrndict, inplace=True)
+        if nbdname:
+            df.rename(columns={nbdname:'nbd'}, inplace=True)
+        record.rows_out = len(df)
     
     return df
     
@@ -250,9 +383,9 @@ def make_db(nbddf, dbname=None, tablename='nbddata'):
     
     For example,
 
-    >>> from datatools.nbddataframe import testdataframe, NBDDataFrame
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
     >>> from datatools.nbddataframe import make_db
-    >>> neigh_dataframe = NBDDataFrame(testdataframe)
+    >>> neigh_dataframe = NBDDataFrame(get_testdataframe())
     >>> engine = make_db(nbddf=neigh_dataframe, tablename='neigh_data')
     >>> con = engine.connect()
     >>> res = con.execute("select latitude from neigh_data where nbd = 'A'")
@@ -262,13 +395,18 @@ def make_db(nbddf, dbname=None, tablename='nbddata'):
     >>> con.close()
     
     """
+    from sqlalchemy import create_engine
+    
     #make the engine
     if dbname is None:
         engine = create_engine('sqlite://')
     else:
         engine = create_engine('sqlite:///{}.db'.format(dbname))
     
-    nbddf.get_df().to_sql(name=tablename, con=engine)
+    df = nbddf.get_df()
+    with instrument.stage('write', 'make_db', len(df)) as record:
+        df.to_sql(name=tablename, con=engine)
+        record.rows_out = len(df)
     return engine    
        
 
@@ -305,21 +443,21 @@ class NBDDataFrame(object):
     
     For example, we read a test DataFrame into an :class:`NBDDataFrame`.
         
-    >>> from datatools.nbddataframe import testdataframe, NBDDataFrame
-    >>> nbddf = NBDDataFrame(testdataframe, debug=True)
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> nbddf = NBDDataFrame(get_testdataframe(), debug=True)
     The DataFrame is in the correct format
     
     An exception is raised if the DataFrame is not in the correct format
     (in this case, a *date* column is missing). 
     
-    >>> nbddf = NBDDataFrame(testdataframe[['latitude', 'longitude']])
+    >>> nbddf = NBDDataFrame(get_testdataframe()[['latitude', 'longitude']])
     Traceback (most recent call last):
         ...
     Exception: DataFrame format error
 
     To print missing data info,
     
-    >>> nbddf = NBDDataFrame(testdataframe)
+    >>> nbddf = NBDDataFrame(get_testdataframe())
     >>> print nbddf.print_info()
     The number of rows is 13.
     2 rows are missing val.
@@ -360,6 +498,8 @@ class NBDDataFrame(object):
     def __init__(self, df, min_lat=minlat, max_lat=maxlat, min_long=minlong, 
                  max_long=maxlong, debug=False):
 
+        #the chunks appended since the DataFrame was last read
+        self._appended = []
         self.df = df
         
         required_cloumns = set(['latitude', 'longitude', 'date'])
@@ -374,6 +514,27 @@ class NBDDataFrame(object):
         self.max_long = max_long
 
         self.seattlemap = None            
+        
+        #the planar coordinates of the rows, cached by get_xy
+        self._xy = None
+    
+    @property
+    def df(self):
+        """
+        The underlying DataFrame, with the chunks appended by 
+        :meth:`append` concatenated on first read.
+        
+        """
+        
+        if self._appended:
+            self._df = pd.concat([self._df] + self._appended)
+            self._appended = []
+        return self._df
+    
+    @df.setter
+    def df(self, df):
+        self._df = df
+        self._appended = []
             
     
     def print_info(self):
@@ -417,11 +578,15 @@ class NBDDataFrame(object):
         
         """
         
-        self.df.replace({'latitude' : 0, 'longitude' : 0}, None)
-        self.df = self.df[(self.df.date.notnull()) & 
-                          (self.df.latitude.notnull()) & 
-                          (self.df.longitude.notnull())
-        ]
+        with instrument.stage('clean', 'remove_missing_data', 
+                              len(self.df)) as record:
+            self.df.replace({'latitude' : 0, 'longitude' : 0}, None)
+            self.df = self.df[(self.df.date.notnull()) & 
+                              (self.df.latitude.notnull()) & 
+                              (self.df.longitude.notnull())
+            ]
+            self._xy = None
+            record.rows_out = len(self.df)
         
     def remove_outofbounds_data(self):
         """
@@ -429,11 +594,228 @@ class NBDDataFrame(object):
         
         """
         
-        self.df = self.df[(self.df.latitude >= self.min_lat) & 
-                          (self.df.latitude <= self.max_lat) & 
-                          (self.df.longitude >= self.min_long) & 
-                          (self.df.longitude <= self.max_long)
-        ]
+        with instrument.stage('clean', 'remove_outofbounds_data', 
+                              len(self.df)) as record:
+            self.df = self.df[(self.df.latitude >= self.min_lat) & 
+                              (self.df.latitude <= self.max_lat) & 
+                              (self.df.longitude >= self.min_long) & 
+                              (self.df.longitude <= self.max_long)
+            ]
+            self._xy = None
+            record.rows_out = len(self.df)
+            
+    def append(self, df):
+        """
+        Append the rows of *df* to the underlying DataFrame. The appended
+        chunks are kept aside and concatenated once, when the DataFrame is
+        next read, so that appending many chunks copies the rows once.
+        
+        Parameters:
+        ___________
+        
+        :param pandas.DataFrame df:
+            the rows to append: at the least, it should have *latitude*,
+            *longitude* and *date* columns
+        
+        Raises:
+        _______
+        
+        :raises Exception: if *df* does not have the required columns
+        
+        For example,
+        
+        >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+        >>> nbddf = NBDDataFrame(get_testdataframe())
+        >>> nbddf.append(get_testdataframe().iloc[:2])
+        >>> len(nbddf.get_df())
+        15
+        
+        """
+        
+        required_cloumns = set(['latitude', 'longitude', 'date'])
+        if not required_cloumns.issubset(df.columns):
+            raise Exception('DataFrame format error')
+        
+        self._appended.append(df)
+        self._xy = None
+        
+    def origin(self):
+        """
+        Get the origin of the planar coordinates of :meth:`get_xy`: the
+        center of the bounds.
+        
+        :rtype: tuple
+        
+        """
+        
+        return bounds_origin(self.min_lat, self.max_lat, self.min_long, 
+                             self.max_long)
+        
+    def get_xy(self, origin=None):
+        """
+        Get the planar coordinates in meters of the rows (see 
+        :func:`datatools.projection.to_planar`), computed once and cached 
+        until the rows change. Distance computations on them are 
+        Euclidean.
+        
+        Parameters:
+        ___________
+        
+        :param tuple origin:
+            (optional) the (latitude, longitude) origin of the coordinates,
+            e.g. the origin of another frame to compare with; default is
+            :meth:`origin`
+        
+        Returns:
+        ________
+        
+        :returns: the x (east) and y (north) coordinates, missing where 
+            the location is missing
+        :rtype: numpy.ndarray, numpy.ndarray
+        
+        For example,
+        
+        >>> from datatools.nbddataframe import get_testdataframe
+        >>> from datatools.nbddataframe import NBDDataFrame
+        >>> nbddf = NBDDataFrame(get_testdataframe())
+        >>> x, y = nbddf.get_xy()
+        >>> x[:2].round(), y[:2].round()
+        (array([-4042., -1597.]), array([ -2777., -25019.]))
+        >>> nbddf.get_xy()[0] is x
+        True
+        >>> nbddf.min_lat = 47.6
+        >>> nbddf.get_xy()[1][:2].round()
+        array([ -8337., -30579.])
+        
+        """
+        
+        if origin is not None and origin != self.origin():
+            return to_planar(self.df.latitude.values, 
+                             self.df.longitude.values, origin)
+        
+        #the origin moves with the bounds
+        origin = self.origin()
+        if self._xy is None or self._xy[0] is not self.df or \
+                self._xy[1] != origin:
+            x, y = to_planar(self.df.latitude.values, 
+                             self.df.longitude.values, origin)
+            self._xy = (self.df, origin, x, y)
+        return self._xy[2:]
+        
+    def spatial_join(self, other, k=1, radius=None, chunksize=100000,
+                     n_jobs=1):
+        """
+        For each row, find the nearest *k* rows of *other* and the
+        distances to them in meters, and optionally count the rows of
+        *other* within *radius* meters. A k-d tree over the planar 
+        coordinates of *other* (see :meth:`get_xy`) is built once and 
+        queried in chunks (see :func:`datatools.spatial.query_tree`).
+        Rows with missing location have no nearest rows, and if *other* 
+        has fewer than *k* rows with a location, the last nearest rows
+        are missing.
+        
+        Parameters:
+        ___________
+        
+        :param NBDDataFrame other:
+            the data to search
+        
+        :param int k:
+            the number of nearest rows to find, default is 1
+        
+        :param float radius:
+            (optional) the radius in meters to count rows within,
+            default is None
+        
+        :param int chunksize:
+            the number of rows in each query, default is 100000
+            
+        :param int n_jobs:
+            the number of processes, default is 1
+        
+        Returns:
+        ________
+        
+        :returns: a DataFrame with the same index as this object's 
+            DataFrame and, for each i from 1 to *k*, a *nearest_i* column 
+            with the index label of the i-th nearest row of *other* and a 
+            *nearest_dist_i* column with the distance to it; if *radius* 
+            is given, a *within_radius* column with the count
+        :rtype: pandas.DataFrame
+        
+        For example,
+        
+        >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+        >>> nbddf = NBDDataFrame(get_testdataframe())
+        >>> nbddf.remove_missing_data()
+        >>> joined = nbddf.spatial_join(nbddf, k=2, radius=5000)
+        >>> joined[['nearest_1', 'nearest_2', 'within_radius']].head(3)
+           nearest_1  nearest_2  within_radius
+        0          0          6              3
+        1          1         11              1
+        2          2          3              4
+        >>> joined.nearest_dist_1.max()
+        0.0
+        
+        With fewer rows to search than *k*, or none,
+        
+        >>> few = NBDDataFrame(get_testdataframe().iloc[:1])
+        >>> nbddf.spatial_join(few, k=2)[['nearest_1', 'nearest_2']].head(2)
+           nearest_1  nearest_2
+        0          0        NaN
+        1          0        NaN
+        >>> nbddf.append(get_testdataframe().iloc[:2])
+        >>> nbddf.spatial_join(few)['nearest_1'].tail(2)
+        0    0
+        1    0
+        Name: nearest_1, dtype: int64
+        >>> none = NBDDataFrame(get_testdataframe().iloc[:0])
+        >>> nbddf.spatial_join(none, radius=5000).head(2)
+           nearest_1  nearest_dist_1  within_radius
+        0        NaN             NaN              0
+        1        NaN             NaN              0
+        
+        """
+        
+        df = self.get_df()
+        otherdf = other.get_df()
+        
+        located = np.asarray(df.latitude.notnull() & df.longitude.notnull())
+        otherlocated = np.asarray(otherdf.latitude.notnull() & 
+                                  otherdf.longitude.notnull())
+        otherlabels = np.asarray(otherdf.index)[otherlocated]
+        
+        #the tree cannot find more rows than it holds
+        found = min(k, len(otherlabels))
+        if found > 0:
+            x, y = self.get_xy()
+            otherx, othery = other.get_xy(origin=self.origin())
+            tree = build_tree(otherx[otherlocated], othery[otherlocated])
+            dist, ind, counts = query_tree(tree, x[located], y[located], 
+                                           k=found, radius=radius, 
+                                           chunksize=chunksize, 
+                                           n_jobs=n_jobs)
+        
+        joined = pd.DataFrame(index=df.index)
+        for i in range(k):
+            #by position, as the index may have duplicate labels
+            nearestdist = np.full(len(df), np.nan)
+            if i < found:
+                nearest = np.full(len(df), np.nan, dtype=object)
+                nearest[located] = otherlabels[ind[:, i]]
+                nearest = pd.Series(nearest, index=df.index).infer_objects()
+                nearestdist[located] = dist[:, i]
+            else:
+                nearest = np.nan
+            joined['nearest_{}'.format(i + 1)] = nearest
+            joined['nearest_dist_{}'.format(i + 1)] = nearestdist
+        if radius is not None:
+            withinradius = np.zeros(len(df), dtype=int)
+            if found > 0:
+                withinradius[located] = counts
+            joined['within_radius'] = withinradius
+        
+        return joined
             
    
     def plot_rowcount_by_month(self, df=None,
@@ -458,16 +840,18 @@ class NBDDataFrame(object):
         if df is None:
             df = self.get_df()
             
-        ax = plt.subplot(111)
-        numrowsbydate = df[['date']].groupby(df.date).count()
-        resamplebymonth = numrowsbydate.resample("M", how="sum")
-        ax.plot(resamplebymonth.index, resamplebymonth)
-        ax.set_title("Row count by month")
-        plt.savefig(filename, dpi=200)
-        plt.clf()
+        with instrument.stage('plot', 'plot_rowcount_by_month', 
+                              len(df)) as record:
+            fig, ax = new_figure()
+            numrowsbydate = df[['date']].groupby(df.date).count()
+            resamplebymonth = numrowsbydate.resample("M", how="sum")
+            draw_rowcount_by_month(ax, resamplebymonth.index, resamplebymonth)
+            fig.savefig(filename, dpi=200)
+            record.rows_out = len(resamplebymonth)
         
         
-    def plot_map(self, df=None, filename="row_locations_map.png"):
+    def plot_map(self, df=None, filename="row_locations_map.png", 
+                 sample=None):
         """
         Plot the number of rows by month.
         
@@ -483,24 +867,192 @@ class NBDDataFrame(object):
             the name of the file with the plot, 
             default is "rowcount_by_month.png"
         
+        :param int sample:
+            (optional) if given, at most this many rows of each 
+            neighborhood are plotted, drawn by :meth:`sample`, 
+            default is None
+        
         """
 
         if df is None:
             df = self.get_df()
         
+        if sample is not None:
+            df = NBDDataFrame(df).sample(sample, seed=0).get_df()
+        
         if self.seattlemap is None:    
             self.setup_map()    
         
-        locax = plt.subplot(111)                              
-        self.seattlemap.drawcoastlines(ax=locax)
-        locax.scatter(df.longitude, df.latitude, s=8, marker='.')
-        locax.set_title("Locations")
-        plt.savefig(filename, dpi=200)
-        plt.clf()
+        with instrument.stage('plot', 'plot_map', len(df)) as record:
+            fig, locax = new_figure()
+            draw_map(locax, self.seattlemap, df.longitude, df.latitude)
+            fig.savefig(filename, dpi=200)
+            record.rows_out = len(df)
+
+    def sample(self, size, freq=None, seed=None):
+        """
+        Draw a stratified sample of the rows, keeping at most *size* rows
+        of each neighborhood (and period), e.g. for exploratory fits and
+        plots; see :class:`datatools.sampling.StratifiedReservoir`.
+        
+        Parameters:
+        ___________
+        
+        :param int size:
+            the largest number of rows kept in each stratum
+        
+        :param str freq:
+            (optional) if given, the strata are the neighborhoods by 
+            period of this frequency, default is None
+        
+        :param int seed:
+            (optional) the seed of the sampling, default is None
+        
+        Returns:
+        ________
+        
+        :returns: the sample, with the same bounds
+        :rtype: :class:`NBDDataFrame`
+        
+        For example,
+        
+        >>> from datatools.nbddataframe import get_testdataframe
+        >>> from datatools.nbddataframe import NBDDataFrame
+        >>> nbddf = NBDDataFrame(get_testdataframe())
+        >>> len(nbddf.sample(3, seed=0).get_df())
+        6
+        
+        """
+        
+        from sampling import sample_frame
+        
+        return sample_frame(self, size, freq=freq, seed=seed)
+
+    def density(self, by_nbd=False, freq=None, bandwidth=300., 
+                shape=(200, 200)):
+        """
+        Compute kernel density surfaces of the rows within the bounds, 
+        for all the rows or for each neighborhood and/or period; see 
+        :func:`datatools.density.density_surfaces`.
+        
+        Parameters:
+        ___________
+        
+        :param bool by_nbd:
+            compute a surface for each neighborhood, default is False
+        
+        :param str freq:
+            (optional) compute a surface for each period of this 
+            frequency, default is None
+        
+        :param float bandwidth:
+            the standard deviation of the Gaussian kernel in meters, 
+            default is 300
+        
+        :param tuple shape:
+            the number of latitude and longitude cells, default is 
+            (200, 200)
+        
+        Returns:
+        ________
+        
+        :returns: the surfaces
+        :rtype: :class:`datatools.density.DensitySurfaces`
+        
+        For example, we compare the densities of the rows of 1987 and of
+        2000 in neighborhood B.
+        
+        >>> from datatools.nbddataframe import get_testdataframe
+        >>> from datatools.nbddataframe import NBDDataFrame
+        >>> nbddf = NBDDataFrame(get_testdataframe())
+        >>> surfaces = nbddf.density(by_nbd=True, freq='A', shape=(50, 40))
+        >>> surfaces.keys # doctest: +NORMALIZE_WHITESPACE
+        [('A', Period('1986', 'A-DEC')), ('A', Period('1987', 'A-DEC')),
+         ('B', Period('1987', 'A-DEC')), ('B', Period('2000', 'A-DEC'))]
+        >>> change = surfaces.difference(('B', '2000'), ('B', '1987'))
+        >>> change.shape
+        (50, 40)
+        >>> surfaces.plot(change, 'density_change.png')
+        >>> nbddf.density(shape=(50, 40)).get(period='2000')
+        Traceback (most recent call last):
+        ...
+        Exception: The surfaces are not by period
+        
+        """
+        
+        with instrument.stage('aggregate', 'density', 
+                              len(self.df)) as record:
+            surfaces = density_surfaces(self.df, (self.min_lat, self.max_lat,
+                                                  self.min_long, 
+                                                  self.max_long),
+                                        by_nbd=by_nbd, freq=freq, 
+                                        bandwidth=bandwidth, shape=shape)
+            record.rows_out = len(surfaces.keys)
+        return surfaces
+
+    def render(self, jobs, nprocs=None, dpi=200):
+        """
+        Render a batch of plots into image files in a process pool, e.g.
+        one plot per neighborhood; see 
+        :func:`datatools.render.render_batch`.
+        
+        Parameters:
+        ___________
+        
+        :param list jobs:
+            the plots, as a list of tuples *(subset, chart, filename)*
+        
+        :param int nprocs:
+            (optional) the number of processes, default is the number of
+            cores
+        
+        :param int dpi:
+            the resolution of the images, default is 200
+        
+        Returns:
+        ________
+        
+        :returns: the file names, in the order of *jobs*
+        :rtype: list
+        
+        """
+        
+        return render_batch(self, jobs, nprocs=nprocs, dpi=dpi)
+
+    def export_shared(self, name=None):
+        """
+        Write the numeric columns into named shared memory blocks, so that
+        worker processes can attach them by name instead of unpickling a
+        copy of the frame; see :func:`datatools.sharedmem.export_frame`.
+        
+        :param str name:
+            (optional) the name of the blocks, default is a new unique name
+        
+        :returns: the owner of the blocks, to release when the workers are
+            done
+        :rtype: :class:`datatools.sharedmem.SharedFrame`
+        
+        For example,
+        
+        >>> from datatools.nbddataframe import get_testdataframe
+        >>> from datatools.nbddataframe import NBDDataFrame
+        >>> from datatools.sharedmem import attach
+        >>> shared = NBDDataFrame(get_testdataframe()).export_shared()
+        >>> len(attach(shared.name))
+        13
+        >>> shared.release()
+        
+        """
+        
+        from sharedmem import export_frame
+        
+        return export_frame(self, name=name)
                      
                 
     def setup_map(self):
     
+        from mpl_toolkits.basemap import Basemap
+        
         self.seattlemap = Basemap(llcrnrlon = self.min_long, 
                                   llcrnrlat = self.min_lat, 
                                   urcrnrlon = self.max_long, 
@@ -520,3 +1072,4 @@ class NBDDataFrame(object):
         """
         
         return self.df
+
@@ -0,0 +1,278 @@
+"""
+Tools to join neighborhood data from several sources into a dense
+neighborhood by period panel.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+aggregations = ('count', 'sum', 'mean')
+"""The supported ways to aggregate a column into a panel metric."""
+
+
+def nbd_codes(df, nbds):
+    """
+    Integer-code the *nbd* column of *df* against the list *nbds*.
+
+    Parameters:
+    ___________
+
+    :param pandas.DataFrame df:
+        the data, it should have an *nbd* column
+
+    :param list nbds:
+        the neighborhoods, in code order
+
+    Returns:
+    ________
+
+    :returns: the code of each row, -1 where the neighborhood is
+        missing or not in *nbds*
+    :rtype: numpy.ndarray
+
+    For example,
+
+    >>> import pandas as pd
+    >>> from datatools.panels import nbd_codes
+    >>> nbd_codes(pd.DataFrame({'nbd' : ['B', 'A', None, 'C']}), ['A', 'B'])
+    array([ 1,  0, -1, -1], dtype=int8)
+
+    """
+
+    return np.asarray(pd.Categorical(df['nbd'], categories=nbds).codes)
+
+
+def period_ordinals(df, freq='M'):
+    """
+    Get the ordinal of the period of frequency *freq* containing the
+    *date* of each row of *df*.
+
+    Parameters:
+    ___________
+
+    :param pandas.DataFrame df:
+        the data, it should have a *date* column
+
+    :param str freq:
+        the period frequency, default is 'M' (monthly)
+
+    Returns:
+    ________
+
+    :returns: the period ordinals and a mask of the rows with a date
+    :rtype: numpy.ndarray, numpy.ndarray
+
+    """
+
+    dates = pd.DatetimeIndex(df['date'])
+    ordinals = np.asarray(dates.to_period(freq).asi8, dtype=np.int64)
+    return ordinals, np.asarray(dates.notnull())
+
+
+class NBDPanel(object):
+    """
+    A dense neighborhood by period by metric array.
+
+    Parameters:
+    ___________
+
+    :param numpy.ndarray values:
+        the panel values, with shape
+        (number of neighborhoods, number of periods, number of metrics)
+
+    :param list nbds:
+        the neighborhoods, in the order of the first axis of *values*
+
+    :param pandas.PeriodIndex periods:
+        the periods, in the order of the second axis of *values*
+
+    :param list metrics:
+        the metric names, in the order of the third axis of *values*
+
+    """
+
+    def __init__(self, values, nbds, periods, metrics):
+
+        self.values = values
+        self.nbds = nbds
+        self.periods = periods
+        self.metrics = metrics
+
+    def get_metric(self, metric):
+        """
+        Get the neighborhood by period array of one metric.
+
+        Parameters:
+        ___________
+
+        :param str metric:
+            the name of the metric
+
+        Returns:
+        ________
+
+        :returns: the metric values
+        :rtype: numpy.ndarray
+
+        """
+
+        return self.values[:, :, self.metrics.index(metric)]
+
+    def to_frame(self):
+        """
+        Get the panel as a DataFrame indexed by neighborhood and period,
+        with a column for each metric.
+
+        Returns:
+        ________
+
+        :returns: the panel as a DataFrame
+        :rtype: pandas.DataFrame
+
+        """
+
+        index = pd.MultiIndex.from_product([self.nbds, self.periods],
+                                           names=['nbd', 'period'])
+        flat = self.values.reshape(-1, len(self.metrics))
+        return pd.DataFrame(flat, index=index, columns=self.metrics)
+
+
+def join_panels(specs, freq='M', nbds=None):
+    """
+    Join several :class:`~datatools.nbddataframe.NBDDataFrame` objects on
+    neighborhood and period into one :class:`NBDPanel`.
+
+    Neighborhoods and periods are integer-coded once per frame, and each
+    metric is aggregated by a direct-address (bincount) join over the
+    combined neighborhood and period code, so no string or datetime merge
+    is ever done.
+
+    Parameters:
+    ___________
+
+    :param list specs:
+        the metrics, as a list of tuples *(nbddf, column, how)* or
+        *(nbddf, column, how, name)*: *nbddf* is an
+        :class:`~datatools.nbddataframe.NBDDataFrame` with an *nbd* column,
+        *column* is the column to aggregate (None to count rows), *how*
+        is one of :attr:`aggregations` and *name* is the metric name,
+        by default *how* prefixed by the column name
+
+    :param str freq:
+        the period frequency, default is 'M' (monthly)
+
+    :param list nbds:
+        (optional) the neighborhoods of the panel: if None, the sorted
+        union of the neighborhoods of all the frames is used, default is
+        None
+
+    Returns:
+    ________
+
+    :returns: the joined panel; sums and counts of empty cells are 0,
+        means are NaN
+    :rtype: :class:`NBDPanel`
+
+    Raises:
+    _______
+
+    :raises Exception: if a frame has no *nbd* column or an aggregation is
+        not supported
+
+    For example, we count the rows and sum *val* by neighborhood and year.
+
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.panels import join_panels
+    >>> nbddf = NBDDataFrame(get_testdataframe())
+    >>> panel = join_panels([(nbddf, None, 'count'), (nbddf, 'val', 'sum')],
+    ...                     freq='A')
+    >>> panel.values.shape
+    (2, 15, 2)
+    >>> panel.metrics
+    ['count', 'val_sum']
+    >>> panel.get_metric('count')[:, [0, 1, 14]]
+    array([[4., 1., 0.],
+           [0., 3., 5.]])
+    >>> panel.to_frame().head(3) # doctest: +NORMALIZE_WHITESPACE
+                count    val_sum
+    nbd period
+    A   1986      4.0  12.102801
+        1987      1.0  -6.059036
+        1988      0.0   0.000000
+
+    """
+
+    names = []
+    for spec in specs:
+        nbddf, column, how = spec[:3]
+        if how not in aggregations:
+            raise Exception('Unsupported aggregation {}'.format(how))
+        if 'nbd' not in nbddf.get_df().columns:
+            raise Exception('DataFrame format error')
+        if len(spec) > 3:
+            names.append(spec[3])
+        elif column is None:
+            names.append(how)
+        else:
+            names.append('{}_{}'.format(column, how))
+
+    #code each distinct frame once, even if it appears in several specs
+    frames = []
+    for spec in specs:
+        if not any(spec[0] is f for f in frames):
+            frames.append(spec[0])
+
+    if nbds is None:
+        nbdset = set()
+        for nbddf in frames:
+            nbdset.update(nbddf.get_df()['nbd'].dropna().unique())
+        nbds = sorted(nbdset)
+
+    codes = {}
+    for nbddf in frames:
+        df = nbddf.get_df()
+        ordinals, dated = period_ordinals(df, freq)
+        codes[id(nbddf)] = (nbd_codes(df, nbds), ordinals, dated)
+
+    dated_ordinals = [o[d] for n, o, d in codes.values() if d.any()]
+    if dated_ordinals:
+        first = min(o.min() for o in dated_ordinals)
+        last = max(o.max() for o in dated_ordinals)
+    else:
+        first, last = 0, -1
+    num_nbds = len(nbds)
+    num_periods = last - first + 1
+    size = num_nbds * num_periods
+
+    values = np.zeros((num_nbds, num_periods, len(specs)))
+    for m, spec in enumerate(specs):
+        nbddf, column, how = spec[:3]
+        nbdcode, ordinals, dated = codes[id(nbddf)]
+        valid = (nbdcode >= 0) & dated
+        weights = None
+        if column is not None:
+            colvalues = np.asarray(nbddf.get_df()[column], dtype=float)
+            valid &= ~np.isnan(colvalues)
+            weights = colvalues[valid]
+
+        key = nbdcode[valid].astype(np.int64) * num_periods
+        key += ordinals[valid] - first
+        counts = np.bincount(key, minlength=size)
+        if how == 'count':
+            agg = counts.astype(float)
+        else:
+            agg = np.bincount(key, weights=weights, minlength=size)
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    agg = np.where(counts > 0, agg / counts, np.nan)
+        values[:, :, m] = agg.reshape(num_nbds, num_periods)
+
+    if num_periods > 0:
+        periods = pd.period_range(start=pd.Period(ordinal=first, freq=freq),
+                                  periods=num_periods, freq=freq)
+    else:
+        periods = pd.PeriodIndex([], freq=freq)
+
+    return NBDPanel(values, nbds, periods, names)
@@ -0,0 +1,266 @@
+"""
+Tools to read a large csv file in parallel: the file is split into byte
+ranges that start and end on record boundaries, each range is parsed in a
+worker process, and the parsed ranges are put back together in order.
+
+Record boundaries are the newlines outside quoted fields, so fields with
+embedded separators and newlines (like the *Address* column of
+``culture.csv``) are never split. They are found with one vectorized pass
+over the file that tracks the parity of the quote characters (an escaped
+quote, written twice, leaves the parity unchanged).
+
+"""
+
+import io
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+
+unsupported_kwargs = ('header', 'skiprows', 'skipfooter', 'nrows',
+                      'chunksize', 'iterator', 'index_col')
+"""The arguments of :func:`pandas.read_csv` that
+:func:`read_csv_parallel` does not support: each range is parsed after
+the header line of the file, applies its own row limits, and gets a
+default index."""
+
+
+def record_boundaries(filename, nparts, quotechar='"', blocksize=2 ** 24):
+    """
+    Split the csv file *filename* into at most *nparts* byte ranges of
+    about the same size that start and end on record boundaries. The
+    header line is not in any range.
+
+    Parameters:
+    ___________
+
+    :param str filename:
+        the name of the csv file
+
+    :param int nparts:
+        the number of ranges wanted
+
+    :param str quotechar:
+        the quote character, default is '"'
+
+    :param int blocksize:
+        the number of bytes scanned at once, default is 2 ** 24
+
+    Returns:
+    ________
+
+    :returns: the header line, and the ranges as (start, end) byte offsets
+    :rtype: str, list
+
+    """
+
+    size = os.path.getsize(filename)
+    if size == 0:
+        return '', []
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    quote = ord(quotechar)
+    newline = ord('\n')
+
+    #the offsets after which to look for a boundary; the first one finds
+    #the end of the header
+    targets = None
+    cuts = []
+    inquotes = False
+    for blockstart in range(0, size, blocksize):
+        block = np.asarray(data[blockstart:blockstart + blocksize])
+        if targets is not None and (not targets or
+                                    targets[0] >= blockstart + len(block)):
+            #no boundary wanted in this block: only the parity matters
+            inquotes ^= bool(np.count_nonzero(block == quote) % 2)
+            continue
+
+        quotes = np.cumsum(block == quote) % 2 == 1
+        if inquotes:
+            quotes = ~quotes
+        boundaries = np.flatnonzero((block == newline) & ~quotes)
+        boundaries += blockstart + 1
+        inquotes = bool(quotes[-1])
+
+        for boundary in boundaries.tolist():
+            if targets is None:
+                #the end of the header; spread the targets over the rest
+                cuts.append(boundary)
+                step = (size - boundary) / float(nparts)
+                targets = [boundary + int(step * i)
+                           for i in range(1, nparts)]
+                continue
+            while targets and boundary > targets[0]:
+                targets.pop(0)
+                if boundary > cuts[-1] and boundary < size:
+                    cuts.append(boundary)
+            if not targets:
+                break
+        if targets is not None and not targets:
+            break
+    del data
+
+    if not cuts:
+        #a header with no newline and no records
+        with open(filename, 'rb') as f:
+            return f.read(), []
+
+    with open(filename, 'rb') as f:
+        header = f.read(cuts[0])
+    cuts.append(size)
+    return header, [(start, end) for start, end in zip(cuts[:-1], cuts[1:])
+                    if end > start]
+
+
+def _parse_range(args):
+    filename, header, start, end, converter, kwargs = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(header + data), **kwargs)
+    if converter is not None:
+        df = converter(df)
+    return df
+
+
+def _map(tasks, nprocs):
+    if nprocs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes=min(nprocs, len(tasks)))
+        try:
+            return pool.map(_parse_range, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return [_parse_range(task) for task in tasks]
+
+
+def _mixed_columns(parts):
+    """
+    Get the columns read as strings in some parts and not in others.
+
+    """
+
+    mixed = set()
+    for col in parts[0].columns:
+        isobject = [part[col].dtype == object for part in parts]
+        if any(isobject) and not all(isobject):
+            mixed.add(col)
+    return mixed
+
+
+def read_csv_parallel(filename, nprocs=None, nparts=None, converter=None,
+                      min_part_bytes=2 ** 22, **kwargs):
+    """
+    Read the csv file *filename* into a DataFrame, parsing byte ranges of
+    the file in *nprocs* processes.
+
+    Parameters:
+    ___________
+
+    :param str filename:
+        the name of the csv file
+
+    :param int nprocs:
+        (optional) the number of processes, default is the number of cores
+
+    :param int nparts:
+        (optional) the number of byte ranges, default is 4 per process
+
+    :param function converter:
+        (optional) a function applied by the worker processes to the
+        DataFrame of each range, e.g. to convert or drop columns before
+        the ranges are sent back; it must be picklable, default is None
+
+    :param int min_part_bytes:
+        the smallest range size: a smaller file is split into fewer
+        ranges, default is 2 ** 22
+
+    The other keyword arguments are passed to :func:`pandas.read_csv`,
+    except those of :attr:`unsupported_kwargs`; *quotechar* is also used
+    to find the record boundaries.
+
+    Each range infers its own column types, so a column can be read as
+    numbers in one range and as strings in another (where
+    :func:`pandas.read_csv` would read it all as strings); the ranges
+    where this happens are parsed again with the column as strings. This
+    is not done when there is a *converter*, which should then set the
+    types itself (e.g. with *dtype=str*).
+
+    Returns:
+    ________
+
+    :returns: the data, with a default index
+    :rtype: pandas.DataFrame
+
+    Raises:
+    _______
+
+    :raises Exception: if an argument of :attr:`unsupported_kwargs` is
+        given
+
+    For example, we make a file with separators and newlines in a quoted
+    field, and check that it is read like :func:`pandas.read_csv` reads it.
+
+    >>> import pandas as pd
+    >>> from datatools.parallelcsv import read_csv_parallel
+    >>> fil = open('test_parallel.csv', 'w')
+    >>> fil.write('Name,Address,Seats\\n')
+    >>> for i in range(1000):
+    ...     fil.write('Space {0},"{0} 5th Ave, ""Suite"" 1\\nSeattle",{0}\\n'
+    ...               .format(i))
+    >>> fil.close()
+    >>> df = read_csv_parallel('test_parallel.csv', nprocs=3,
+    ...                        min_part_bytes=1000)
+    >>> df.equals(pd.read_csv('test_parallel.csv'))
+    True
+    >>> df.loc[999, 'Address']
+    '999 5th Ave, "Suite" 1\\nSeattle'
+
+    Column types agree with :func:`pandas.read_csv` even when they differ
+    between the ranges.
+
+    >>> culture = read_csv_parallel('culture.csv', nprocs=2, nparts=8,
+    ...                             min_part_bytes=1)
+    >>> culture.equals(pd.read_csv('culture.csv'))
+    True
+    >>> read_csv_parallel('culture.csv', nrows=10)
+    Traceback (most recent call last):
+    ...
+    Exception: Unsupported argument nrows
+
+    """
+
+    for name in unsupported_kwargs:
+        if name in kwargs:
+            raise Exception('Unsupported argument {}'.format(name))
+
+    nprocs = nprocs or multiprocessing.cpu_count()
+    size = os.path.getsize(filename)
+    nparts = nparts or 4 * nprocs
+    nparts = max(1, min(nparts, size // min_part_bytes))
+
+    header, ranges = record_boundaries(filename, nparts,
+                                       quotechar=kwargs.get('quotechar', '"'))
+    if not ranges:
+        df = pd.read_csv(filename, **kwargs)
+        return converter(df) if converter is not None else df
+
+    tasks = [(filename, header, start, end, converter, kwargs)
+             for start, end in ranges]
+    parts = _map(tasks, nprocs)
+
+    dtype = kwargs.get('dtype')
+    if converter is None and (dtype is None or isinstance(dtype, dict)):
+        mixed = _mixed_columns(parts)
+        if mixed:
+            redokwargs = dict(kwargs)
+            redokwargs['dtype'] = dict(dtype or {})
+            redokwargs['dtype'].update((col, object) for col in mixed)
+            redo = [i for i, part in enumerate(parts)
+                    if any(part[col].dtype != object for col in mixed)]
+            redotasks = [tasks[i][:5] + (redokwargs,) for i in redo]
+            for i, part in zip(redo, _map(redotasks, nprocs)):
+                parts[i] = part
+
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,74 @@
+"""
+Tools to project latitudes and longitudes onto local planar x/y
+coordinates in meters, with a vectorized equirectangular projection about
+an origin, so that distances are Euclidean. Over a city (tens of
+kilometers) the distances are within a fraction of a percent of the great
+circle distances, and a meter of x is a meter of y, where a degree of
+longitude is only about two thirds of a degree of latitude in Seattle.
+
+"""
+
+import numpy as np
+
+
+earth_radius = 6371008.8
+"""The mean radius of the earth, in meters."""
+
+
+def bounds_origin(min_lat, max_lat, min_long, max_long):
+    """
+    Get the origin of the projection of the places within bounds: the
+    center of the bounds.
+
+    :rtype: tuple
+
+    """
+
+    return ((min_lat + max_lat) / 2., (min_long + max_long) / 2.)
+
+
+def to_planar(lat, lon, origin):
+    """
+    Project the places with latitudes *lat* and longitudes *lon* (in
+    degrees) onto planar coordinates in meters, east (x) and north (y) of
+    *origin*, a (latitude, longitude) tuple. Missing values stay missing.
+
+    :returns: the x and y coordinates
+    :rtype: numpy.ndarray, numpy.ndarray
+
+    For example, in Seattle a degree of longitude is about two thirds of a
+    degree of latitude.
+
+    >>> from datatools.projection import to_planar
+    >>> x, y = to_planar([47.6, 48.6, 47.6], [-122.3, -122.3, -121.3],
+    ...                  origin=(47.6, -122.3))
+    >>> x.round(), y.round()
+    (array([    0.,     0., 74979.]), array([     0., 111195.,      0.]))
+
+    """
+
+    lat0, lon0 = origin
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    scale = np.radians(earth_radius)
+    x = (lon - lon0) * (scale * np.cos(np.radians(lat0)))
+    y = (lat - lat0) * scale
+    return x, y
+
+
+def from_planar(x, y, origin):
+    """
+    Get the latitudes and longitudes of the planar coordinates *x* and *y*
+    about *origin*, the inverse of :func:`to_planar`.
+
+    :returns: the latitudes and longitudes
+    :rtype: numpy.ndarray, numpy.ndarray
+
+    """
+
+    lat0, lon0 = origin
+    scale = np.radians(earth_radius)
+    lat = lat0 + np.asarray(y, dtype=float) / scale
+    lon = lon0 + np.asarray(x, dtype=float) / (scale *
+                                               np.cos(np.radians(lat0)))
+    return lat, lon
@@ -0,0 +1,241 @@
+"""
+Tools to draw the plots of :class:`~datatools.nbddataframe.NBDDataFrame`
+with the object-oriented matplotlib API and the Agg canvas, so that no
+global pyplot state is used, and to render batches of plots (e.g. one per
+neighborhood) in a process pool.
+
+The data every plot of a batch needs (the map, the monthly row counts of
+the neighborhoods and the point coordinates) is computed once, before the
+workers are started, and shared with them.
+
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from panels import nbd_codes, period_ordinals
+
+
+charts = ('rowcount_by_month', 'map')
+"""The supported chart types."""
+
+#the data shared with the workers, set by _init_worker
+_state = None
+
+
+def new_figure():
+    """
+    Make a figure with one axes, drawn on its own Agg canvas.
+
+    :returns: the figure and the axes
+    :rtype: matplotlib.figure.Figure, matplotlib.axes.Axes
+
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    pd.options.display.mpl_style = 'default'
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(111)
+
+
+def draw_rowcount_by_month(ax, dates, counts):
+    """
+    Draw the row counts *counts* of the months ending on *dates* on the
+    axes *ax*.
+
+    """
+
+    ax.plot(dates, counts)
+    ax.set_title("Row count by month")
+
+
+def draw_map(ax, seattlemap, longitude, latitude):
+    """
+    Draw the coastlines of the Basemap *seattlemap* and the points at
+    *longitude* and *latitude* on the axes *ax*.
+
+    """
+
+    seattlemap.drawcoastlines(ax=ax)
+    ax.scatter(longitude, latitude, s=8, marker='.')
+    ax.set_title("Locations")
+
+
+def draw_density(ax, surface, extent, title=None):
+    """
+    Draw the density surface *surface* (from south to north and west to
+    east) over *extent* (west, east, south, north) on the axes *ax*. A
+    surface with negative values, such as a difference of densities, is
+    drawn with a diverging color map centered on 0.
+
+    """
+
+    if surface.min() < 0:
+        limit = np.abs(surface).max()
+        image = ax.imshow(surface, origin='lower', extent=extent,
+                          cmap='RdBu_r', vmin=-limit, vmax=limit,
+                          aspect='auto')
+    else:
+        image = ax.imshow(surface, origin='lower', extent=extent,
+                          cmap='YlOrRd', aspect='auto')
+    ax.figure.colorbar(image, ax=ax, label='points per square km')
+    ax.set_title(title or "Density")
+
+
+def _subset_names(subset):
+    if subset is None:
+        return None
+    if isinstance(subset, basestring):
+        return [subset]
+    return list(subset)
+
+
+def _init_worker(state):
+    global _state
+    _state = state
+
+
+def _render_job(job):
+    names, chart, filename = job
+    fig, ax = new_figure()
+
+    if names is None:
+        rows = slice(None)
+        mask = None
+    else:
+        rows = [_state['nbds'].index(name) + 1 for name in names]
+        mask = np.in1d(_state['codes'], np.array(rows) - 1)
+
+    if chart == 'rowcount_by_month':
+        counts = _state['monthly'][rows].sum(axis=0)
+        nonzero = np.flatnonzero(counts)
+        if len(nonzero) > 0:
+            counts = counts[nonzero[0]:nonzero[-1] + 1]
+            dates = _state['month_ends'][nonzero[0]:nonzero[-1] + 1]
+        else:
+            dates = _state['month_ends'][:0]
+        draw_rowcount_by_month(ax, dates, counts)
+    else:
+        longitude, latitude = _state['longitude'], _state['latitude']
+        if mask is not None:
+            longitude, latitude = longitude[mask], latitude[mask]
+        draw_map(ax, _state['seattlemap'], longitude, latitude)
+
+    fig.savefig(filename, dpi=_state['dpi'])
+    return filename
+
+
+def _shared_state(nbddf, jobs, dpi):
+    df = nbddf.get_df()
+    names = set()
+    for subset, chart, filename in jobs:
+        names.update(subset or [])
+    nbds = sorted(names)
+    state = {'nbds' : nbds, 'dpi' : dpi, 'codes' : None}
+    if nbds:
+        state['codes'] = nbd_codes(df, nbds)
+
+    if any(chart == 'rowcount_by_month' for subset, chart, f in jobs):
+        #the monthly row counts of the rows of no named neighborhood (first
+        #row) and of each named neighborhood, from one bincount
+        ordinals, dated = period_ordinals(df, 'M')
+        codes = state['codes'] if nbds else np.full(len(df), -1, np.int8)
+        codes = codes[dated].astype(np.int64) + 1
+        ordinals = ordinals[dated]
+        first = ordinals.min() if len(ordinals) > 0 else 0
+        num_periods = ordinals.max() - first + 1 if len(ordinals) > 0 else 0
+        monthly = np.bincount(codes * num_periods + ordinals - first,
+                              minlength=(len(nbds) + 1) * num_periods)
+        state['monthly'] = monthly.reshape(len(nbds) + 1, num_periods)
+        months = pd.period_range(start=pd.Period(ordinal=first, freq='M'),
+                                 periods=num_periods, freq='M')
+        state['month_ends'] = (months + 1).to_timestamp() - \
+            pd.Timedelta(days=1)
+
+    if any(chart == 'map' for subset, chart, f in jobs):
+        if nbddf.seattlemap is None:
+            nbddf.setup_map()
+        state['seattlemap'] = nbddf.seattlemap
+        state['longitude'] = np.asarray(df['longitude'])
+        state['latitude'] = np.asarray(df['latitude'])
+    return state
+
+
+def render_batch(nbddf, jobs, nprocs=None, dpi=200):
+    """
+    Render a batch of plots of *nbddf* into image files.
+
+    Parameters:
+    ___________
+
+    :param nbddf:
+        the data, as an :class:`~datatools.nbddataframe.NBDDataFrame`,
+        with an *nbd* column if some plots are of neighborhoods
+
+    :param list jobs:
+        the plots, as a list of tuples *(subset, chart, filename)*:
+        *subset* is None for all the rows, or the name or list of names of
+        the neighborhoods whose rows are plotted, and *chart* is one of
+        :attr:`charts`
+
+    :param int nprocs:
+        (optional) the number of processes, default is the number of cores
+
+    :param int dpi:
+        the resolution of the images, default is 200
+
+    Returns:
+    ________
+
+    :returns: the file names, in the order of *jobs*
+    :rtype: list
+
+    Raises:
+    _______
+
+    :raises Exception: if a chart type is not supported
+
+    For example, we plot the row counts by month of all the rows and of
+    each neighborhood.
+
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.render import render_batch
+    >>> nbddf = NBDDataFrame(get_testdataframe())
+    >>> jobs = [(None, 'rowcount_by_month', 'test_render_all.png')]
+    >>> jobs += [(nbd, 'rowcount_by_month', 'test_render_{}.png'.format(nbd))
+    ...          for nbd in ['A', 'B']]
+    >>> render_batch(nbddf, jobs, nprocs=2)
+    ['test_render_all.png', 'test_render_A.png', 'test_render_B.png']
+
+    """
+
+    jobs = [(_subset_names(subset), chart, filename)
+            for subset, chart, filename in jobs]
+    for subset, chart, filename in jobs:
+        if chart not in charts:
+            raise Exception('Unsupported chart {}'.format(chart))
+
+    nprocs = nprocs or multiprocessing.cpu_count()
+    with instrument.stage('plot', 'render_batch',
+                          len(nbddf.get_df())) as record:
+        state = _shared_state(nbddf, jobs, dpi)
+        if nprocs > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(processes=min(nprocs, len(jobs)),
+                                        initializer=_init_worker,
+                                        initargs=(state,))
+            try:
+                filenames = pool.map(_render_job, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_worker(state)
+            filenames = [_render_job(job) for job in jobs]
+        record.rows_out = len(filenames)
+    return filenames
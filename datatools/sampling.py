@@ -0,0 +1,261 @@
+"""
+Tools to draw bounded, representative samples of neighborhood data in a
+single pass: stratified reservoir sampling by neighborhood (and
+optionally by period), over data in memory or streamed from a csv file
+or a database in chunks. Every stratum keeps up to a fixed number of
+rows, so rare neighborhoods are kept whole while common ones are thinned.
+
+Each row is given a random priority, and each stratum keeps its rows of
+smallest priority: a uniform sample without replacement of the rows of
+the stratum seen so far, whatever the order and chunking of the rows.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from nbddataframe import NBDDataFrame, rename_cols
+
+
+class StratifiedReservoir(object):
+    """
+    A stratified reservoir sample of rows of neighborhood data, fed with
+    chunks of rows by :meth:`update`.
+
+    Parameters:
+    ___________
+
+    :param int size:
+        the largest number of rows kept in each stratum
+
+    :param str freq:
+        (optional) if given, the strata are the neighborhoods by period of
+        this frequency, otherwise the neighborhoods; default is None
+
+    :param int seed:
+        (optional) the seed of the random priorities, default is None
+
+    Rows with no neighborhood (or, by period, no date) form their own
+    stratum.
+
+    For example, we keep at most 2 rows per neighborhood.
+
+    >>> from datatools.nbddataframe import get_testdataframe
+    >>> from datatools.sampling import StratifiedReservoir
+    >>> df = get_testdataframe()
+    >>> reservoir = StratifiedReservoir(2, seed=0)
+    >>> reservoir.update(df.iloc[:6])
+    >>> reservoir.update(df.iloc[6:])
+    >>> reservoir.sample()['nbd'].value_counts().sort_index()
+    A    2
+    B    2
+    Name: nbd, dtype: int64
+    >>> reservoir.stratum_sizes()
+    nbd
+    A    5
+    B    8
+    Name: rows, dtype: int64
+
+    """
+
+    def __init__(self, size, freq=None, seed=None):
+
+        self.size = size
+        self.freq = freq
+        self._random = np.random.RandomState(seed)
+        self._sample = None
+        self._priorities = np.zeros(0)
+        self._seen = {}
+
+    def _strata(self, df):
+        nbds = df['nbd'] if 'nbd' in df.columns else \
+            pd.Series(np.nan, index=df.index)
+        nbdcodes, nbduniques = pd.factorize(nbds)
+        if self.freq is None:
+            return nbdcodes, np.zeros(len(df), dtype=np.int64), nbduniques
+        dates = pd.DatetimeIndex(df['date'])
+        #undated rows get the NaT ordinal, the smallest int64
+        ordinals = np.asarray(dates.to_period(self.freq).asi8,
+                              dtype=np.int64)
+        return nbdcodes, ordinals, nbduniques
+
+    def update(self, df):
+        """
+        Add the rows of the chunk *df* (with an *nbd* column, and a *date*
+        column if the strata are by period) to the sample.
+
+        """
+
+        with instrument.stage('aggregate', 'StratifiedReservoir.update',
+                              len(df)) as record:
+            priorities = self._random.random_sample(len(df))
+            if self._sample is not None:
+                combined = pd.concat([self._sample, df])
+                priorities = np.concatenate([self._priorities, priorities])
+                new = np.arange(len(combined)) >= len(self._sample)
+            else:
+                combined = df
+                new = np.ones(len(df), dtype=bool)
+
+            nbdcodes, ordinals, nbduniques = self._strata(combined)
+            order = np.lexsort((priorities, ordinals, nbdcodes))
+            nbdcodes, ordinals = nbdcodes[order], ordinals[order]
+            starts = np.ones(len(order), dtype=bool)
+            starts[1:] = ((nbdcodes[1:] != nbdcodes[:-1]) |
+                          (ordinals[1:] != ordinals[:-1]))
+            startpos = np.flatnonzero(starts)
+            groups = np.cumsum(starts) - 1
+            ranks = np.arange(len(order)) - startpos[groups]
+
+            #count the new rows of each stratum
+            newcounts = np.bincount(groups, weights=new[order],
+                                    minlength=len(startpos))
+            for g, start in enumerate(startpos):
+                if newcounts[g] == 0:
+                    continue
+                nbd = nbduniques[nbdcodes[start]] if nbdcodes[start] >= 0 \
+                    else None
+                key = nbd
+                if self.freq is not None:
+                    period = None
+                    if ordinals[start] != np.iinfo(np.int64).min:
+                        period = pd.Period(ordinal=ordinals[start],
+                                           freq=self.freq)
+                    key = (nbd, period)
+                self._seen[key] = self._seen.get(key, 0) + int(newcounts[g])
+
+            keep = order[ranks < self.size]
+            self._sample = combined.iloc[keep]
+            self._priorities = priorities[keep]
+            record.rows_out = len(keep)
+
+    def sample(self):
+        """
+        Get the sample, in stratum order.
+
+        :rtype: pandas.DataFrame
+
+        """
+
+        return self._sample
+
+    def stratum_sizes(self):
+        """
+        Get the number of rows seen in each stratum, e.g. to weight the
+        sample rows by the number of rows they stand for.
+
+        :returns: the sizes, indexed by neighborhood (and period)
+        :rtype: pandas.Series
+
+        """
+
+        keys = sorted(self._seen, key=lambda key: str(key))
+        if self.freq is None:
+            index = pd.Index(keys, name='nbd')
+        else:
+            index = pd.MultiIndex.from_tuples(keys, names=['nbd', 'period'])
+        return pd.Series([self._seen[key] for key in keys], index=index,
+                         name='rows')
+
+
+def sample_frame(nbddf, size, freq=None, seed=None):
+    """
+    Draw a stratified sample of at most *size* rows per neighborhood (and
+    period of frequency *freq*, if given) of the
+    :class:`~datatools.nbddataframe.NBDDataFrame` *nbddf*.
+
+    :returns: the sample, with the bounds of *nbddf*
+    :rtype: :class:`~datatools.nbddataframe.NBDDataFrame`
+
+    """
+
+    reservoir = StratifiedReservoir(size, freq=freq, seed=seed)
+    reservoir.update(nbddf.get_df())
+    return NBDDataFrame(reservoir.sample(), min_lat=nbddf.min_lat,
+                        max_lat=nbddf.max_lat, min_long=nbddf.min_long,
+                        max_long=nbddf.max_long)
+
+
+def sample_csv(filename, size, freq=None, seed=None, chunksize=100000,
+               nbdname=None, latname='latitude', longname='longitude',
+               datename='date', sep='\t', locname=None):
+    """
+    Draw a stratified sample of at most *size* rows per neighborhood (and
+    period of frequency *freq*, if given) of the csv file *filename* in
+    one pass, reading *chunksize* rows at a time. The other parameters are
+    as in :func:`~datatools.nbddataframe.get_csv_data`.
+
+    :returns: the sample, compatible with
+        :class:`~datatools.nbddataframe.NBDDataFrame`
+    :rtype: pandas.DataFrame
+
+    For example,
+
+    >>> from datatools.sampling import sample_csv
+    >>> sample = sample_csv('culture.csv', 3, seed=0, chunksize=100,
+    ...                     nbdname='Neighborhood',
+    ...                     datename='Year of Occupation', sep=',',
+    ...                     locname='Location')
+    >>> sample['nbd'].value_counts().max()
+    3
+
+    """
+
+    reservoir = StratifiedReservoir(size, freq=freq, seed=seed)
+    reader = pd.read_csv(filename, sep=sep, chunksize=chunksize)
+    for chunk in reader:
+        reservoir.update(rename_cols(chunk, nbdname=nbdname,
+                                     latname=latname, longname=longname,
+                                     datename=datename, locname=locname))
+    return reservoir.sample()
+
+
+def sample_db(engine, size, freq=None, seed=None, chunksize=100000,
+              tablename='nbddata', nbdname=None, latname='latitude',
+              longname='longitude', datename='date', index_col=None):
+    """
+    Draw a stratified sample of at most *size* rows per neighborhood (and
+    period of frequency *freq*, if given) of a database table in one pass,
+    reading *chunksize* rows at a time. The other parameters are as in
+    :func:`~datatools.nbddataframe.get_db_data`.
+
+    :returns: the sample, compatible with
+        :class:`~datatools.nbddataframe.NBDDataFrame`
+    :rtype: pandas.DataFrame
+
+    For example,
+
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.nbddataframe import make_db
+    >>> from datatools.sampling import sample_db
+    >>> engine = make_db(NBDDataFrame(get_testdataframe()))
+    >>> len(sample_db(engine, 1, freq='A', seed=0, chunksize=5,
+    ...               nbdname='nbd', index_col='index'))
+    4
+
+    """
+
+    reservoir = StratifiedReservoir(size, freq=freq, seed=seed)
+    reader = pd.read_sql_table(tablename, engine, parse_dates=[datename],
+                               index_col=index_col, chunksize=chunksize)
+    for chunk in reader:
+        reservoir.update(rename_cols(chunk, nbdname=nbdname,
+                                     latname=latname, longname=longname,
+                                     datename=datename))
+    return reservoir.sample()
+
+
+def get_loc_and_n(df):
+    """
+    Get the rows of *df* with a neighborhood and a location in the format
+    of the parameter of :class:`nbdtools.nbdpred.NbdPred`, e.g. to train
+    it on a sample.
+
+    :rtype: list
+
+    """
+
+    df = df.dropna(subset=['latitude', 'longitude', 'nbd'])
+    return [[lat, lon, nbd] for lat, lon, nbd in
+            zip(df['latitude'], df['longitude'], df['nbd'])]
@@ -0,0 +1,359 @@
+"""
+Tools to infer the schema of a raw csv export (such as ``culture.csv``)
+from a sample of its rows, and to read it into a typed, compact DataFrame:
+normalized column names, bool for Y/N flags, the smallest integer type
+that fits for years and counts, and categoricals for repeated labels.
+
+"""
+
+import functools
+import re
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from parallelcsv import read_csv_parallel
+
+
+true_values = ['Y', 'YES', 'TRUE', 'T']
+"""The values read as True (case is ignored)."""
+
+false_values = ['N', 'NO', 'FALSE', 'F']
+"""The values read as False (case is ignored)."""
+
+_int_types = [np.int8, np.int16, np.int32, np.int64]
+
+
+def normalize_name(name):
+    """
+    Normalize the column name *name*: lower case, '#' becomes 'num', and
+    runs of other characters than letters and digits become '_'.
+
+    For example,
+
+    >>> from datatools.schema import normalize_name
+    >>> normalize_name('# Parking Spaces?')
+    'num_parking_spaces'
+    >>> normalize_name(' Seats total? ')
+    'seats_total'
+
+    """
+
+    name = name.strip().lower().replace('#', 'num')
+    return re.sub(r'[^0-9a-z]+', '_', name).strip('_')
+
+
+def _smallest_int(values):
+    for inttype in _int_types:
+        info = np.iinfo(inttype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return np.dtype(inttype).name
+    return 'float64'
+
+
+def _exact_float(values):
+    #the smallest float type, from float32, that holds the integer values
+    #exactly
+    return 'float32' if values.abs().max() <= 2 ** 24 else 'float64'
+
+
+def _fit_dtype(numbers, dtype):
+    """
+    Widen the numeric type *dtype* so that it holds the values *numbers*:
+    an integer type with missing or fractional values becomes float, and
+    a type too small for the range of the values is promoted.
+
+    """
+
+    present = numbers.dropna()
+    if len(present) == 0:
+        return dtype if dtype.startswith('float') else 'float32'
+    if not (present == np.round(present)).all():
+        return 'float64'
+    if dtype.startswith('int') and len(present) == len(numbers):
+        needed = _smallest_int(present)
+    else:
+        needed = _exact_float(present)
+        if dtype.startswith('int'):
+            dtype = needed
+    return np.promote_types(dtype, needed).name
+
+
+def infer_dtype(values, category_ratio=0.5, max_categories=1000):
+    """
+    Infer the compact type of a column from a sample of its raw values.
+
+    Parameters:
+    ___________
+
+    :param pandas.Series values:
+        the sample, as strings (missing values are NaN)
+
+    :param float category_ratio:
+        a column of strings with at most this fraction of distinct
+        values is categorical, default is 0.5
+
+    :param int max_categories:
+        a column of strings with more distinct values is never
+        categorical, default is 1000
+
+    Returns:
+    ________
+
+    :returns: the type: 'bool' for Y/N flags, an integer type (the smallest that fits
+        the sample, or float32 or float64, whichever holds the sample
+        exactly, if some are missing), 'float64',
+        'category' or 'object'
+    :rtype: str
+
+    For example,
+
+    >>> import pandas as pd
+    >>> from datatools.schema import infer_dtype
+    >>> infer_dtype(pd.Series(['Y', 'n', 'N']))
+    'bool'
+    >>> infer_dtype(pd.Series(['1962', '2001', None]))
+    'float32'
+    >>> infer_dtype(pd.Series(['1962', '2001', '1885']))
+    'int16'
+    >>> infer_dtype(pd.Series(['Arts Ed', 'Visual', 'Arts Ed', 'Arts Ed']))
+    'category'
+
+    """
+
+    total = len(values)
+    values = values.dropna().astype(str).str.strip()
+    values = values[values != '']
+    missing = len(values) < total
+    if len(values) == 0:
+        return 'object'
+
+    upper = values.str.upper()
+    if upper.isin(true_values + false_values).all():
+        return 'bool'
+
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notnull().all():
+        if (numbers == np.round(numbers)).all() and \
+                values.str.match(r'^[-+]?\d+$').all():
+            if not missing:
+                return _smallest_int(numbers)
+            #a sample says little about the range of the other rows, so
+            #float16 (exact up to 2048 only) is never chosen
+            return _exact_float(numbers)
+        return 'float64'
+
+    distinct = values.nunique()
+    if distinct <= max_categories and distinct <= category_ratio * len(values):
+        return 'category'
+    return 'object'
+
+
+def infer_schema(filename, sample_rows=1000, sep=',', **kwargs):
+    """
+    Infer the schema of the csv file *filename* from its first
+    *sample_rows* rows.
+
+    Parameters:
+    ___________
+
+    :param str filename:
+        the name of the csv file
+
+    :param int sample_rows:
+        the number of rows sampled, default is 1000
+
+    :param str sep:
+        the separation character, default is ','
+
+    The other keyword arguments are passed to :func:`infer_dtype`.
+
+    Returns:
+    ________
+
+    :returns: the schema, from raw column name to a tuple of normalized
+        name and type
+    :rtype: collections.OrderedDict
+
+    """
+
+    sample = pd.read_csv(filename, sep=sep, nrows=sample_rows, dtype=str,
+                         keep_default_na=False, na_values=[''])
+    schema = OrderedDict()
+    for col in sample.columns:
+        schema[col] = (normalize_name(col), infer_dtype(sample[col], **kwargs))
+    return schema
+
+
+def apply_schema(df, schema, final=True):
+    """
+    Convert the raw columns of *df* to the types of *schema*, one whole
+    column at a time, and rename them. Values that cannot be read as the
+    type become missing; a numeric type is widened to hold the range of
+    the values (the schema being inferred from a sample); an integer
+    column with missing values becomes float, and a flag column with
+    missing values becomes float16 (1, 0 or NaN).
+
+    Parameters:
+    ___________
+
+    :param pandas.DataFrame df:
+        the raw data, as strings
+
+    :param collections.OrderedDict schema:
+        the schema, as made by :func:`infer_schema`
+
+    :param bool final:
+        if False, leave flag columns as float16 and categorical columns as
+        strings, so that chunks of a file can be concatenated; then call
+        :func:`finish_schema` on the concatenation; default is True
+
+    Returns:
+    ________
+
+    :returns: the typed data
+    :rtype: pandas.DataFrame
+
+    For example, years beyond the sample of the schema do not wrap around.
+
+    >>> import pandas as pd
+    >>> from collections import OrderedDict
+    >>> from datatools.schema import apply_schema
+    >>> schema = OrderedDict([('Year', ('year', 'int16')),
+    ...                       ('Seats', ('seats', 'float32'))])
+    >>> df = apply_schema(pd.DataFrame({'Year' : ['1990', '70000'],
+    ...                                 'Seats' : [None, '16777217']}),
+    ...                   schema)
+    >>> df.dtypes # doctest: +NORMALIZE_WHITESPACE
+    year       int32
+    seats    float64
+    dtype: object
+    >>> df.year.tolist(), df.seats.tolist()
+    ([1990, 70000], [nan, 16777217.0])
+
+    """
+
+    typed = OrderedDict()
+    for col, (name, dtype) in schema.items():
+        values = df[col]
+        if dtype == 'bool' and values.dtype == object:
+            upper = values.str.strip().str.upper()
+            flags = pd.Series(np.nan, index=df.index, dtype='float16')
+            flags[upper.isin(true_values)] = 1
+            flags[upper.isin(false_values)] = 0
+            typed[name] = flags
+        elif dtype.startswith('int') or dtype.startswith('float'):
+            numbers = pd.to_numeric(values, errors='coerce')
+            typed[name] = numbers.astype(_fit_dtype(numbers, dtype))
+        else:
+            typed[name] = values
+    typed = pd.DataFrame(typed, index=df.index)
+
+    if final:
+        finish_schema(typed, schema)
+    return typed
+
+
+def finish_schema(df, schema):
+    """
+    Convert, in place, the flag columns of *df* with no missing values to
+    bool and the categorical columns to categoricals (see
+    :func:`apply_schema`).
+
+    """
+
+    for name, dtype in schema.values():
+        if dtype == 'bool' and df[name].notnull().all():
+            df[name] = df[name].astype(bool)
+        elif dtype == 'category':
+            df[name] = df[name].astype('category')
+
+
+def read_typed_csv(filename, schema=None, sample_rows=1000, sep=',',
+                   chunksize=None, nprocs=None):
+    """
+    Read the csv file *filename* into a typed, compact DataFrame.
+
+    Parameters:
+    ___________
+
+    :param str filename:
+        the name of the csv file
+
+    :param collections.OrderedDict schema:
+        (optional) the schema: if None, it is inferred by
+        :func:`infer_schema` from the first *sample_rows* rows,
+        default is None
+
+    :param int sample_rows:
+        the number of rows sampled, default is 1000
+
+    :param str sep:
+        the separation character, default is ','
+
+    :param int chunksize:
+        (optional) if given, the file is read and converted this many rows
+        at a time, so that only one chunk is held as strings; default is
+        None
+
+    :param int nprocs:
+        (optional) if more than 1, byte ranges of the file are read and
+        converted in this many processes by
+        :func:`datatools.parallelcsv.read_csv_parallel` (and *chunksize*
+        is ignored), default is None
+
+    Returns:
+    ________
+
+    :returns: the typed data
+    :rtype: pandas.DataFrame
+
+    For example,
+
+    >>> from datatools.schema import read_typed_csv
+    >>> fil = open('test_schema.csv', 'w')
+    >>> fil.write('Name,Nonprofit?,Year Founded,Seats total?,Discipline\\n'
+    ...           'A,Y,1982,0,Arts Ed\\n'
+    ...           'B,N,1987,,Arts Ed\\n'
+    ...           'C,y,2005,120,Visual\\n'
+    ...           'D,N,1946,80,Arts Ed\\n')
+    >>> fil.close()
+    >>> df = read_typed_csv('test_schema.csv', chunksize=3)
+    >>> df.dtypes # doctest: +NORMALIZE_WHITESPACE
+    name               object
+    nonprofit            bool
+    year_founded        int16
+    seats_total       float32
+    discipline       category
+    dtype: object
+    >>> df.nonprofit.tolist()
+    [True, False, True, False]
+    >>> read_typed_csv('test_schema.csv', nprocs=2).equals(df)
+    True
+
+    """
+
+    if schema is None:
+        schema = infer_schema(filename, sample_rows=sample_rows, sep=sep)
+
+    if nprocs > 1:
+        converter = functools.partial(apply_schema, schema=schema,
+                                      final=False)
+        df = read_csv_parallel(filename, nprocs=nprocs, converter=converter,
+                               sep=sep, dtype=str, keep_default_na=False,
+                               na_values=[''])
+        finish_schema(df, schema)
+        return df
+
+    reader = pd.read_csv(filename, sep=sep, dtype=str, keep_default_na=False,
+                         na_values=[''], chunksize=chunksize)
+    if chunksize is None:
+        return apply_schema(reader, schema)
+
+    #flags and categories are set once all the chunks are read, so that
+    #the chunks agree
+    df = pd.concat([apply_schema(chunk, schema, final=False)
+                    for chunk in reader])
+    finish_schema(df, schema)
+    return df
@@ -0,0 +1,334 @@
+"""
+Tools to hand the numeric columns of an
+:class:`~datatools.nbddataframe.NBDDataFrame` to worker processes through
+shared memory instead of pickling the frame to each of them: the
+coordinates, the planar coordinates, the dates (as int64 nanoseconds) and
+the integer neighborhood codes are written once into named memory mapped
+blocks, and the workers attach read-only views of them by name, with no
+copy.
+
+The blocks are files in /dev/shm where it exists (so they live in
+memory), and in the temporary directory otherwise.
+
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import instrument
+
+
+#the shared frame attached in a worker, set by _init_worker
+_frame = None
+
+
+def shared_dir():
+    """
+    Get the directory of the shared blocks: /dev/shm if it exists,
+    otherwise the temporary directory.
+
+    :rtype: str
+
+    """
+
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class SharedFrame(object):
+    """
+    The numeric columns of a frame in named shared blocks, made by
+    :func:`export_frame` (the owner, which releases the blocks) or
+    :func:`attach` (e.g. in a worker process).
+
+    The columns are in :attr:`arrays`, a dict of read-only
+    :class:`numpy.memmap` arrays: *latitude*, *longitude*, *x* and *y*
+    (see :meth:`~datatools.nbddataframe.NBDDataFrame.get_xy`), and, if
+    the frame has them, *date* (nanoseconds since the epoch, missing dates
+    being the smallest int64) and *nbd* (the index in :attr:`nbds`, -1 if
+    missing).
+
+    Parameters:
+    ___________
+
+    :param str name:
+        the name of the blocks
+
+    :param str path:
+        the directory of the blocks
+
+    :param dict meta:
+        the number of rows, the columns, the neighborhood names, the
+        bounds and the origin of the planar coordinates
+
+    :param bool owner:
+        whether :meth:`release` removes the blocks, default is False
+
+    """
+
+    def __init__(self, name, path, meta, owner=False):
+
+        self.name = name
+        self.path = path
+        self.nbds = meta['nbds']
+        self.bounds = meta['bounds']
+        self.origin = meta['origin']
+        self.owner = owner
+        self.arrays = {}
+        for column in meta['columns']:
+            if meta['rows'] == 0:
+                #a memmap cannot be empty
+                self.arrays[column] = np.load(self._file(column))
+            else:
+                self.arrays[column] = np.load(self._file(column),
+                                              mmap_mode='r')
+
+    def __len__(self):
+        return len(self.arrays['latitude'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _file(self, column):
+        return os.path.join(self.path, column + '.npy')
+
+    def get_df(self, rows=slice(None)):
+        """
+        Get the rows *rows* (a slice or an index array, default is all of
+        them) as a DataFrame with *latitude*, *longitude*, *date* and
+        *nbd* columns, as in :class:`~datatools.nbddataframe.NBDDataFrame`.
+        Unlike :attr:`arrays`, the DataFrame is a copy.
+
+        :rtype: pandas.DataFrame
+
+        """
+
+        df = pd.DataFrame({'latitude' : self.arrays['latitude'][rows],
+                           'longitude' : self.arrays['longitude'][rows]})
+        if 'date' in self.arrays:
+            df['date'] = pd.DatetimeIndex(
+                np.array(self.arrays['date'][rows]))
+        if 'nbd' in self.arrays:
+            df['nbd'] = pd.Categorical.from_codes(
+                np.array(self.arrays['nbd'][rows]), self.nbds)
+        return df
+
+    def get_nbddataframe(self, rows=slice(None)):
+        """
+        Get the rows *rows* as an
+        :class:`~datatools.nbddataframe.NBDDataFrame` with the bounds of
+        the exported frame.
+
+        """
+
+        from nbddataframe import NBDDataFrame
+
+        min_lat, max_lat, min_long, max_long = self.bounds
+        return NBDDataFrame(self.get_df(rows), min_lat=min_lat,
+                            max_lat=max_lat, min_long=min_long,
+                            max_long=max_long)
+
+    def release(self):
+        """
+        Drop the views, and remove the blocks if this is the owner. Views
+        still held elsewhere stay valid until they are dropped.
+
+        """
+
+        self.arrays = {}
+        if self.owner and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+
+def export_frame(nbddf, name=None, directory=None):
+    """
+    Write the numeric columns of the
+    :class:`~datatools.nbddataframe.NBDDataFrame` *nbddf* into shared
+    blocks.
+
+    Parameters:
+    ___________
+
+    :param nbddf:
+        the data
+
+    :param str name:
+        (optional) the name of the blocks, default is a new unique name
+
+    :param str directory:
+        (optional) the directory of the blocks, default is
+        :func:`shared_dir`
+
+    Returns:
+    ________
+
+    :returns: the owner of the blocks, which removes them on
+        :meth:`~SharedFrame.release` or at the end of a with statement
+    :rtype: :class:`SharedFrame`
+
+    For example, the attached columns are views of the exported blocks.
+
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.sharedmem import export_frame, attach
+    >>> nbddf = NBDDataFrame(get_testdataframe())
+    >>> with export_frame(nbddf) as shared:
+    ...     attached = attach(shared.name)
+    ...     print sorted(attached.arrays)
+    ...     print attached.nbds, attached.arrays['nbd'][:4]
+    ...     print attached.get_df().equals(nbddf.get_df()[['latitude',
+    ...         'longitude', 'date', 'nbd']].astype({'nbd' : 'category'}))
+    ['date', 'latitude', 'longitude', 'nbd', 'x', 'y']
+    ['A', 'B'] [1 0 1 1]
+    True
+
+    """
+
+    df = nbddf.get_df()
+    name = name or 'nbd_' + uuid.uuid4().hex
+    path = os.path.join(directory or shared_dir(), name)
+    if os.path.exists(path):
+        raise Exception('Shared frame {} already exists'.format(name))
+
+    with instrument.stage('load', 'export_frame', len(df)) as record:
+        x, y = nbddf.get_xy()
+        columns = {'latitude' : np.asarray(df['latitude'], dtype=float),
+                   'longitude' : np.asarray(df['longitude'], dtype=float),
+                   'x' : x, 'y' : y}
+        nbds = []
+        if 'date' in df.columns:
+            columns['date'] = np.asarray(pd.DatetimeIndex(df['date']).asi8,
+                                         dtype=np.int64)
+        if 'nbd' in df.columns:
+            codes = pd.Categorical(df['nbd'])
+            nbds = list(codes.categories)
+            columns['nbd'] = np.asarray(codes.codes, dtype=np.int32)
+
+        os.mkdir(path)
+        try:
+            for column, values in columns.items():
+                np.save(os.path.join(path, column + '.npy'), values)
+            meta = {'rows' : len(df), 'columns' : sorted(columns),
+                    'nbds' : nbds, 'origin' : nbddf.origin(),
+                    'bounds' : (nbddf.min_lat, nbddf.max_lat,
+                                nbddf.min_long, nbddf.max_long)}
+            with open(os.path.join(path, 'meta.pkl'), 'wb') as f:
+                pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+        except:
+            shutil.rmtree(path)
+            raise
+        record.rows_out = len(df)
+    return SharedFrame(name, path, meta, owner=True)
+
+
+def attach(name, directory=None):
+    """
+    Attach read-only views of the shared blocks named *name* in
+    *directory* (default is :func:`shared_dir`).
+
+    :rtype: :class:`SharedFrame`
+
+    :raises Exception: if there are no such blocks
+
+    """
+
+    path = os.path.join(directory or shared_dir(), name)
+    try:
+        with open(os.path.join(path, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+    except IOError:
+        raise Exception('No shared frame {}'.format(name))
+    return SharedFrame(name, path, meta)
+
+
+def _init_worker(name, directory):
+    global _frame
+    _frame = attach(name, directory)
+
+
+def _run_chunk(args):
+    func, start, stop = args
+    return func(_frame, slice(start, stop))
+
+
+def map_chunks(func, shared, nprocs=None, chunksize=100000):
+    """
+    Apply *func* to chunks of the rows of the shared frame *shared* in a
+    process pool, each worker attaching the blocks once by name.
+
+    Parameters:
+    ___________
+
+    :param func:
+        a module level function of a :class:`SharedFrame` and a slice of
+        rows, e.g. :func:`nbd_counts`
+
+    :param shared:
+        the data, as a :class:`SharedFrame`
+
+    :param int nprocs:
+        (optional) the number of processes, default is the number of cores
+
+    :param int chunksize:
+        the number of rows of each chunk, default is 100000
+
+    Returns:
+    ________
+
+    :returns: the results of the chunks, in row order
+    :rtype: list
+
+    For example, we count the rows of each neighborhood in chunks of 5
+    rows.
+
+    >>> from datatools.nbddataframe import get_testdataframe, NBDDataFrame
+    >>> from datatools.sharedmem import export_frame, map_chunks, nbd_counts
+    >>> with export_frame(NBDDataFrame(get_testdataframe())) as shared:
+    ...     sum(map_chunks(nbd_counts, shared, nprocs=2, chunksize=5))
+    array([5, 8])
+
+    """
+
+    nprocs = nprocs or multiprocessing.cpu_count()
+    chunks = [(func, start, min(start + chunksize, len(shared)))
+              for start in range(0, len(shared), chunksize)]
+    directory = os.path.dirname(shared.path)
+    with instrument.stage('aggregate', 'map_chunks',
+                          len(shared)) as record:
+        if nprocs > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(processes=min(nprocs, len(chunks)),
+                                        initializer=_init_worker,
+                                        initargs=(shared.name, directory))
+            try:
+                results = pool.map(_run_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [func(shared, slice(start, stop))
+                       for f, start, stop in chunks]
+        record.rows_out = len(results)
+    return results
+
+
+def nbd_counts(shared, rows):
+    """
+    Count the rows *rows* of the shared frame *shared* in each
+    neighborhood, in the order of :attr:`SharedFrame.nbds`.
+
+    :rtype: numpy.ndarray
+
+    """
+
+    codes = shared.arrays['nbd'][rows]
+    return np.bincount(codes[codes >= 0], minlength=len(shared.nbds))
@@ -0,0 +1,146 @@
+"""
+Tools to find the nearest places and count the places within a radius of
+neighborhood data, using a k-d tree over planar x/y coordinates in meters
+(see :mod:`datatools.projection`), so that every distance is Euclidean.
+
+"""
+
+import multiprocessing
+
+import numpy as np
+
+
+def build_tree(x, y):
+    """
+    Build a k-d tree over the places with planar coordinates *x* and *y*
+    (in meters).
+
+    Parameters:
+    ___________
+
+    :param numpy.ndarray x:
+        the x coordinates, they should not be missing
+
+    :param numpy.ndarray y:
+        the y coordinates, they should not be missing
+
+    Returns:
+    ________
+
+    :returns: the k-d tree
+    :rtype: sklearn.neighbors.KDTree
+
+    """
+
+    from sklearn.neighbors import KDTree
+
+    return KDTree(np.column_stack([x, y]))
+
+
+#the tree a worker process queries, set once by _init_worker
+_worker_tree = None
+
+
+def _init_worker(tree):
+    global _worker_tree
+    _worker_tree = tree
+
+
+def _query_chunk(args):
+    points, k, radius = args
+    return _query_points(_worker_tree, points, k, radius)
+
+
+def _query_points(tree, points, k, radius):
+    dist, ind = tree.query(points, k=k)
+    counts = None
+    if radius is not None:
+        counts = tree.query_radius(points, r=radius, count_only=True)
+    return dist, ind, counts
+
+
+def query_tree(tree, x, y, k=1, radius=None, chunksize=100000, n_jobs=1):
+    """
+    Find the *k* nearest places in *tree* to each place with planar
+    coordinates *x* and *y*, and optionally count the places in *tree*
+    within *radius* meters of it. The queries are made in chunks of
+    *chunksize* places, in *n_jobs* processes.
+
+    Parameters:
+    ___________
+
+    :param sklearn.neighbors.KDTree tree:
+        the tree, as made by :func:`build_tree`
+
+    :param numpy.ndarray x:
+        the x coordinates of the query places, in the projection of the
+        tree; they should not be missing
+
+    :param numpy.ndarray y:
+        the y coordinates of the query places, they should not be missing
+
+    :param int k:
+        the number of nearest places to find, default is 1
+
+    :param float radius:
+        (optional) the radius in meters to count places within,
+        default is None
+
+    :param int chunksize:
+        the number of places in each query, default is 100000
+
+    :param int n_jobs:
+        the number of processes, default is 1
+
+    Returns:
+    ________
+
+    :returns: the distances in meters and the positions in the tree of
+        the nearest places, both of shape (number of places, *k*), and the
+        counts within *radius* (None if *radius* is None)
+    :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+
+    For example,
+
+    >>> from datatools.projection import to_planar
+    >>> from datatools.spatial import build_tree, query_tree
+    >>> origin = (47.6, -122.3)
+    >>> tree = build_tree(*to_planar([47.6, 47.61], [-122.3, -122.3], origin))
+    >>> x, y = to_planar([47.601], [-122.3], origin)
+    >>> dist, ind, counts = query_tree(tree, x, y, radius=500)
+    >>> ind
+    array([[0]])
+    >>> round(dist[0, 0])
+    111.0
+    >>> counts
+    array([1])
+
+    """
+
+    points = np.column_stack([x, y])
+    chunks = [(points[start:start + chunksize], k, radius)
+              for start in range(0, len(points), chunksize)]
+
+    if n_jobs > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(processes=n_jobs,
+                                    initializer=_init_worker,
+                                    initargs=(tree,))
+        try:
+            results = pool.map(_query_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_query_points(tree, *chunk) for chunk in chunks]
+
+    if not results:
+        empty = np.empty((0, k))
+        counts = np.empty(0, dtype=int) if radius is not None else None
+        return empty, empty.astype(int), counts
+
+    dist = np.concatenate([r[0] for r in results])
+    ind = np.concatenate([r[1] for r in results])
+    counts = None
+    if radius is not None:
+        counts = np.concatenate([r[2] for r in results])
+    return dist, ind, counts
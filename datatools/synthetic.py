@@ -0,0 +1,169 @@
+"""
+Tools to generate synthetic neighborhood data of any size, shaped like
+:attr:`datatools.nbddataframe.testdata`, for testing and benchmarking.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+seattle_centers = [
+    ('Downtown', 47.6062, -122.3321, 0.006, 12.0),
+    ('Capitol Hill', 47.6253, -122.3222, 0.007, 10.0),
+    ('Ballard', 47.6686, -122.3860, 0.009, 7.0),
+    ('Fremont', 47.6510, -122.3500, 0.006, 5.0),
+    ('University District', 47.6610, -122.3130, 0.007, 6.0),
+    ('Queen Anne', 47.6370, -122.3570, 0.007, 5.0),
+    ('Beacon Hill', 47.5670, -122.3080, 0.010, 3.0),
+    ('West Seattle', 47.5700, -122.3870, 0.012, 4.0),
+    ('Columbia City', 47.5590, -122.2870, 0.006, 2.0),
+    ('Northgate', 47.7060, -122.3270, 0.009, 3.0),
+    ('Greenwood', 47.6900, -122.3550, 0.008, 2.5),
+    ('Rainier Beach', 47.5220, -122.2680, 0.006, 0.5),
+]
+"""The synthetic neighborhoods, as tuples of name, center latitude, center
+longitude, spread in degrees and relative weight. The weights are uneven so
+that some neighborhoods are rare."""
+
+
+def make_testdata_frame(size, seed=None, missing_rate=0.01,
+                        outofbounds_rate=0.01, start='1986-01-01',
+                        end='2015-12-31'):
+    """
+    Make a DataFrame of *size* rows with the columns of
+    :attr:`datatools.nbddataframe.testdata` (*val*, *lat*, *lon*, *rand*,
+    *neighborhood* and *date*). Places are clustered around the
+    :attr:`seattle_centers`.
+
+    Parameters:
+    ___________
+
+    :param int size:
+        the number of rows
+
+    :param int seed:
+        (optional) the random seed, default is None
+
+    :param float missing_rate:
+        the fraction of rows missing each of *val* and *lon*,
+        default is 0.01
+
+    :param float outofbounds_rate:
+        the fraction of rows with a location out of the default bounds,
+        default is 0.01
+
+    :param str start:
+        the earliest date, default is '1986-01-01'
+
+    :param str end:
+        the latest date, default is '2015-12-31'
+
+    Returns:
+    ________
+
+    :returns: the synthetic data
+    :rtype: pandas.DataFrame
+
+    For example,
+
+    >>> from datatools.synthetic import make_testdata_frame
+    >>> df = make_testdata_frame(1000, seed=0)
+    >>> list(df.columns)
+    ['val', 'lat', 'lon', 'rand', 'neighborhood', 'date']
+    >>> len(df), df.neighborhood.nunique()
+    (1000, 12)
+
+    """
+
+    rng = np.random.RandomState(seed)
+
+    names = np.array([c[0] for c in seattle_centers], dtype=object)
+    centers = np.array([c[1:4] for c in seattle_centers])
+    weights = np.array([c[4] for c in seattle_centers])
+
+    cluster = rng.choice(len(seattle_centers), size=size,
+                         p=weights / weights.sum())
+    lat = centers[cluster, 0] + rng.normal(size=size) * centers[cluster, 2]
+    lon = centers[cluster, 1] + rng.normal(size=size) * centers[cluster, 2]
+
+    #push some rows south of the default bounds
+    outofbounds = rng.random_sample(size) < outofbounds_rate
+    lat[outofbounds] -= 0.2
+
+    val = rng.normal(scale=5.0, size=size)
+    val[rng.random_sample(size) < missing_rate] = np.nan
+    lon[rng.random_sample(size) < missing_rate] = np.nan
+
+    first = pd.Timestamp(start).value // 86400000000000
+    last = pd.Timestamp(end).value // 86400000000000
+    days = rng.randint(first, last + 1, size=size).astype(np.int64)
+    dates = pd.to_datetime(days * 86400000000000)
+
+    df = pd.DataFrame({'val' : val, 'lat' : lat, 'lon' : lon,
+                       'rand' : rng.random_sample(size),
+                       'neighborhood' : names[cluster], 'date' : dates})
+    return df[['val', 'lat', 'lon', 'rand', 'neighborhood', 'date']]
+
+
+def write_testdata(filename, size, seed=None, **kwargs):
+    """
+    Write a tab-separated csv of *size* synthetic rows made by
+    :func:`make_testdata_frame`, readable by
+    :func:`datatools.nbddataframe.get_csv_data` like
+    :attr:`datatools.nbddataframe.testdata`.
+
+    Parameters:
+    ___________
+
+    :param str filename:
+        the name of the csv file
+
+    :param int size:
+        the number of rows
+
+    :param int seed:
+        (optional) the random seed, default is None
+
+    The other keyword arguments are passed to :func:`make_testdata_frame`.
+
+    """
+
+    df = make_testdata_frame(size, seed=seed, **kwargs)
+    df.to_csv(filename, sep='\t', index=False, date_format='%m/%d/%Y')
+
+
+def make_loc_and_n(size, seed=None):
+    """
+    Make a list of *size* places with known neighborhood, suitable for
+    :class:`nbdtools.nbdpred.NbdPred`.
+
+    Parameters:
+    ___________
+
+    :param int size:
+        the number of places
+
+    :param int seed:
+        (optional) the random seed, default is None
+
+    Returns:
+    ________
+
+    :returns: the places, each a list of latitude, longitude and
+        neighborhood
+    :rtype: list
+
+    For example,
+
+    >>> from datatools.synthetic import make_loc_and_n
+    >>> loc_and_n = make_loc_and_n(100, seed=0)
+    >>> len(loc_and_n), len(loc_and_n[0])
+    (100, 3)
+
+    """
+
+    df = make_testdata_frame(size, seed=seed, missing_rate=0,
+                             outofbounds_rate=0)
+    return [list(r) for r in zip(df.lat.tolist(), df.lon.tolist(),
+                                 df.neighborhood.tolist())]
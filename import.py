@@ -1,47 +1,46 @@
-import csv
-
-class importer(filename):
-    csvfilename = ''
-    row = 0
-    parsedDict = []
-    
-    def __init__(self, filename):
-        setFilename(filename)
-        pass
-    
-    def setFilename(filename):
-        self.csvfilename = filename
-        pass
-    #Will read from specified line using an internal counter by default
-    def readLine(row = self.row, delimiter = ','):
-        with open('eggs.csv', 'rb') as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=' ', quotechar='|')
-            for row in spamreader:
-               self.parsedDict.add(row) 
-        pass
-#    Import the csv
-#   Read the 1st line into dictionary header class var
-#   Ea. read line will take the next line and map
-    pass
-
-with open('culture.csv', 'rb') as csvfile:
-     spamreader = csv.DictReader(csvfile, delimiter=',', quotechar='|')
-     for row in spamreader:
-        print ', '.join(row)
-
-
-from peewee import *
-import MySQLdb
-
-database = MySQLDatabase('gentry')
-
-db = MySQLdb.Connect(host='localhost',
-                     user='root',
-                     db = 'gentry')
-
-cur = db.cursor()
-
-cur.execute("select * from building_permit limit 10")
-
-
-                                        
\ No newline at end of file
+"""
+Import csv exports of city data into the database through the import
+ledger, e.g. nightly: exports that did not change are skipped without
+being read, and only the new and changed rows of the others are written
+(see :meth:`csv_importer.importer.syncFile`).
+
+Run, for example,
+
+    python import.py culture.csv building_permit.csv --keys name,address
+
+"""
+
+import argparse
+
+from csv_importer import importer, default_dburl
+from datatools.ledger import ImportLedger
+from datatools.schema import normalize_name
+
+
+def main(argv=None):
+    summary = __doc__.split('\n\n')[0].strip()
+    parser = argparse.ArgumentParser(description=summary)
+    parser.add_argument('filenames', nargs='+')
+    parser.add_argument('--db', default=default_dburl)
+    parser.add_argument('--keys', default='name,address',
+                        help='comma separated identifying columns of the '
+                        'rows, default is name,address')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    keys = [normalize_name(key) for key in args.keys.split(',')]
+    ledger = None
+    for filename in args.filenames:
+        imp = importer(filename, dburl=args.db, batchsize=args.batch_size)
+        if ledger is None:
+            ledger = ImportLedger(imp.getEngine())
+        counts = imp.syncFile(keys, ledger=ledger)
+        if counts is None:
+            print '{}: unchanged, skipped'.format(filename)
+        else:
+            print ('{}: {inserted} rows inserted, {updated} updated, '
+                   '{unchanged} unchanged'.format(filename, **counts))
+
+
+if __name__ == '__main__':
+    main()
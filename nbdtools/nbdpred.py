@@ -1,7 +1,51 @@
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
 import numpy as np
-from sklearn.neighbors import KNeighborsClassifier
+from datatools import instrument
+from datatools.projection import to_planar
+
+#matplotlib and sklearn are slow to import, so they are imported on first use
+
+
+class PlanarNN(object):
+    """
+    A nearest neighbor predictor of the neighborhood of locations, which projects them onto planar coordinates in meters about *origin* (see :func:`datatools.projection.to_planar`), so that neighbors are found by true distance rather than by distance in degrees.
+    
+    :param tuple origin: the (latitude, longitude) origin of the projection
+    
+    """
+    
+    def __init__(self, origin):
+        
+        self.origin = origin
+        self.model = None
+    
+    def fit(self, points, nbds):
+        """
+        Train the predictor on the locations *points* (pairs of latitude and longitude) of neighborhoods *nbds*.
+        
+        """
+        
+        from sklearn.neighbors import KNeighborsClassifier
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.model = KNeighborsClassifier(n_neighbors=1)
+        self.model.fit(np.column_stack(to_planar(points[:, 0], points[:, 1], self.origin)), nbds)
+        return self
+    
+    def predict_xy(self, xy):
+        """
+        Predict the neighborhoods of locations given by planar coordinates *xy* (pairs of x and y).
+        
+        """
+        
+        return self.model.predict(np.asarray(xy, dtype=float).reshape(-1, 2))
+    
+    def predict(self, points):
+        """
+        Predict the neighborhoods of the locations *points*, one pair of latitude and longitude or a list of them.
+        
+        """
+        
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return self.predict_xy(np.column_stack(to_planar(points[:, 0], points[:, 1], self.origin)))
 
 
 class NbdPred(object):
@@ -46,13 +90,29 @@ class NbdPred(object):
         #Assign a random color to each neighborhood
         self.neighborhood_colors = {n:map(lambda x : x*0.8, (np.random.random(), np.random.random(), np.random.random())) for n in self.neighborhoods}
 
-        #Create color map
-        self.ncmap = ListedColormap([self.neighborhood_colors[n] for n in self.neighborhoods_list])
+        self._ncmap = None
+
+        self.NN = None
+        """The nearest neighbor predictor trained on all the places, set by :meth:`fit`."""
         
         #Get the lats and longs
         self.latis = [r[0] for r in self.loc_and_n]
         self.longis =  [r[1] for r in self.loc_and_n]
         
+        self.origin = (float(np.mean(self.latis)), float(np.mean(self.longis)))
+        """The origin of the planar coordinates: the mean location."""
+        
+        #the planar coordinates in meters, computed once
+        self.xs, self.ys = to_planar(self.latis, self.longis, self.origin)
+        
+
+    @property
+    def ncmap(self):
+        """The color map of the neighborhoods, created on first use."""
+        if self._ncmap is None:
+            from matplotlib.colors import ListedColormap
+            self._ncmap = ListedColormap([self.neighborhood_colors[n] for n in self.neighborhoods_list])
+        return self._ncmap
 
     def make_predictor(self, train_percent):
         """
@@ -67,7 +127,7 @@ class NbdPred(object):
         _______
         
         :return: a nearest neighbor predictor and its classification rate
-        :rtype: :class:`sklearn.neighbors.KNeighborsClassifier`, float
+        :rtype: :class:`PlanarNN`, float
         
         >>> from nbdtools.nbdpred import NbdPred
         >>> loc_and_n = [[0, 0, 'A'], [0, 1, 'A'], [2, 0, 'B'], [2, 1, 'B']] 
@@ -104,25 +164,125 @@ class NbdPred(object):
         test_data = [self.loc_and_n[ind] for ind in test_data_indices]
 
         #train a nearest neighbor classifier
-        NN = KNeighborsClassifier(n_neighbors=1)
-        NN.fit([place[:2] for place in train_data], [place[2] for place in train_data])
+        with instrument.stage('fit', 'make_predictor', len(train_data)) as record:
+            NN = PlanarNN(self.origin)
+            NN.fit([place[:2] for place in train_data], [place[2] for place in train_data])
+            record.rows_out = len(train_data)
         
         #what's the classification rate on the test set?
-        class_rate = sum([NN.predict(place[:2]) == place[2] for place in test_data])/float(len(test_data))
+        with instrument.stage('predict', 'make_predictor', len(test_data)) as record:
+            class_rate = sum([NN.predict(place[:2]) == place[2] for place in test_data])/float(len(test_data))
+            record.rows_out = len(test_data)
         
         return NN, class_rate[0]
     
-    def plot_decision_regions(self, points = True):
-        xx, yy = np.meshgrid(np.arange(min(self.longis), max(self.longis), 0.0005), np.arange(min(self.latis), max(self.latis), 0.0005))
-        Z = np.array(map(lambda n: self.neighborhoods_list.index(n), self.NN.predict(zip(yy.ravel(), xx.ravel()))))
-        Z = Z.reshape(xx.shape)
-        c = [self.neighborhoods_list.index(r[2]) for r in self.loc_and_n]
-        plt.pcolormesh(xx,yy,Z, cmap = plt.get_cmap("Paired"))
-        if points:
-            plt.scatter(self.longis, self.latis, c = c, cmap = plt.get_cmap("Paired"))
+    def sample(self, size, seed=None):
+        """
+        Get a predictor of a stratified sample of the places, with at most *size* places of each neighborhood, e.g. for exploratory fits and plots on huge data sets. Rare neighborhoods keep all their places.
+        
+        Parameters
+        __________
+        
+        :param int size: the largest number of places of each neighborhood
+        :param int seed: (optional) the seed of the sampling
+        
+        Returns
+        _______
+        
+        :return: the predictor of the sample
+        :rtype: :class:`NbdPred`
+        
+        >>> from nbdtools.nbdpred import NbdPred
+        >>> loc_and_n = [[0, 0, 'A'], [0, 1, 'A'], [2, 0, 'B'], [2, 1, 'B']] 
+        >>> npred = NbdPred(loc_and_n)
+        >>> sorted(npred.sample(1, seed=0).nfreq.items())
+        [('A', 1), ('B', 1)]
+        
+        """
+        
+        import pandas as pd
+        from datatools.sampling import StratifiedReservoir
+        
+        places = pd.DataFrame({'latitude' : self.latis, 'longitude' : self.longis, 'nbd' : [r[2] for r in self.loc_and_n]})
+        reservoir = StratifiedReservoir(size, seed=seed)
+        reservoir.update(places)
+        sample = reservoir.sample()
+        return NbdPred([[lat, lon, nbd] for lat, lon, nbd in zip(sample.latitude, sample.longitude, sample.nbd)])
+    
+    def fit(self):
+        """
+        Train a nearest neighbor predictor on all the places, for :meth:`predict`.
+        
+        Returns
+        _______
+        
+        :return: the nearest neighbor predictor, also set as :attr:`NN`
+        :rtype: :class:`PlanarNN`
+        
+        """
+        
+        with instrument.stage('fit', 'fit', len(self.loc_and_n)) as record:
+            self.NN = PlanarNN(self.origin)
+            self.NN.fit(np.column_stack([self.latis, self.longis]), [place[2] for place in self.loc_and_n])
+            record.rows_out = len(self.loc_and_n)
+        return self.NN
+    
+    def predict(self, points):
+        """
+        Predict the neighborhoods of a batch of locations with the predictor trained by :meth:`fit` (which is called first if needed).
+        
+        Parameters
+        __________
+        
+        :param points: the locations, as a list or an array of pairs of floats
+        
+        Returns
+        _______
+        
+        :return: the neighborhood of each location
+        :rtype: numpy.ndarray
+        
+        >>> from nbdtools.nbdpred import NbdPred
+        >>> loc_and_n = [[0, 0, 'A'], [0, 1, 'A'], [2, 0, 'B'], [2, 1, 'B']] 
+        >>> npred = NbdPred(loc_and_n)
+        >>> print npred.predict([[0, 2], [3, 0]])
+        ['A' 'B']
+        
+        """
+        
+        if self.NN is None:
+            self.fit()
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return np.array([], dtype=object)
+        with instrument.stage('predict', 'predict', len(points)) as record:
+            nbds = self.NN.predict(points)
+            record.rows_out = len(nbds)
+        return nbds
+    
+    def plot_decision_regions(self, points = True, step = 50.):
+        import matplotlib.pyplot as plt
+        from datatools.projection import from_planar
+        if self.NN is None:
+            self.fit()
+        #a grid of square cells of step meters, drawn in degrees
+        xx, yy = np.meshgrid(np.arange(self.xs.min(), self.xs.max(), step), np.arange(self.ys.min(), self.ys.max(), step))
+        with instrument.stage('predict', 'plot_decision_regions', xx.size) as record:
+            names = np.array(self.neighborhoods_list)
+            order = np.argsort(names)
+            predicted = self.NN.predict_xy(np.column_stack([xx.ravel(), yy.ravel()]))
+            Z = order[np.searchsorted(names[order], predicted)].reshape(xx.shape)
+            record.rows_out = Z.size
+        yy, xx = from_planar(xx, yy, self.origin)
+        with instrument.stage('plot', 'plot_decision_regions', len(self.loc_and_n)) as record:
+            c = [self.neighborhoods_list.index(r[2]) for r in self.loc_and_n]
+            plt.pcolormesh(xx,yy,Z, cmap = plt.get_cmap("Paired"))
+            if points:
+                plt.scatter(self.longis, self.latis, c = c, cmap = plt.get_cmap("Paired"))
 
-        cbar = plt.colorbar(ticks = range(self.num_neighborhoods))
-        cbar.ax.set_yticklabels(self.neighborhoods_list)
-        plt.show()
+            cbar = plt.colorbar(ticks = range(self.num_neighborhoods))
+            cbar.ax.set_yticklabels(self.neighborhoods_list)
+            plt.show()
+            record.rows_out = len(self.loc_and_n)
         
         
@@ -0,0 +1,538 @@
+"""
+A local neighborhood lookup service: a server, on localhost or on a Unix
+socket, that loads the neighborhood predictor of :class:`NbdPred` once and
+answers "which neighborhood is this location in" for single locations or
+small batches. It needs no network access beyond the local socket.
+
+Requests are handled in their own threads, and the locations of
+concurrent requests are coalesced by a :class:`MicroBatcher` into one
+vectorized prediction. Per-request latencies, batch sizes and throughput
+are served as metrics.
+
+The HTTP interface is
+
+- ``GET /lookup?lat=47.61&lon=-122.33``: the neighborhood of one location,
+  as ``{"nbd": ...}``,
+- ``POST /lookup`` with ``{"points": [[lat, lon], ...]}``: the
+  neighborhoods of a batch of locations, as ``{"nbds": [...]}``,
+- ``GET /metrics``: the metrics, as returned by
+  :meth:`ServiceMetrics.snapshot`,
+- ``GET /health``: ``{"status": "ok"}``.
+
+Run, for example,
+
+    python -m nbdtools.service places.csv --port 8765
+
+or, on a Unix socket,
+
+    python -m nbdtools.service places.csv --socket /tmp/nbd.sock
+
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import httplib
+import json
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+import urlparse
+
+import numpy as np
+
+from nbdpred import NbdPred
+
+
+class ServiceMetrics(object):
+    """
+    Thread-safe metrics of a lookup service: the numbers of requests,
+    locations and batches, and the latencies of the last *window*
+    requests and sizes of the last *window* batches.
+
+    """
+
+    def __init__(self, window=10000):
+
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.points = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    def record_batch(self, latencies, points, error=False):
+        """
+        Record a batch of requests with latencies *latencies* (in seconds)
+        and *points* locations in all.
+
+        """
+
+        with self._lock:
+            self.requests += len(latencies)
+            self.points += points
+            self.batches += 1
+            if error:
+                self.errors += len(latencies)
+            self.latencies.extend(latencies)
+            self.batch_sizes.append(points)
+
+    def snapshot(self):
+        """
+        Get the metrics.
+
+        :returns: the counts, the throughput since the start in requests
+            and locations per second, the mean batch size in locations,
+            and the 50th, 95th and 99th percentiles and maximum of the
+            recent latencies in milliseconds
+        :rtype: dict
+
+        """
+
+        with self._lock:
+            uptime = max(time.time() - self.started, 1e-9)
+            latencies = np.array(self.latencies) * 1000.
+            snapshot = {'requests' : self.requests, 'points' : self.points,
+                        'batches' : self.batches, 'errors' : self.errors,
+                        'uptime_s' : uptime,
+                        'requests_per_s' : self.requests / uptime,
+                        'points_per_s' : self.points / uptime,
+                        'mean_batch_points' :
+                            float(np.mean(self.batch_sizes))
+                            if self.batch_sizes else 0.}
+        if len(latencies) > 0:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            snapshot['latency_ms'] = {'p50' : p50, 'p95' : p95, 'p99' : p99,
+                                      'max' : latencies.max()}
+        else:
+            snapshot['latency_ms'] = {}
+        return snapshot
+
+
+class _Request(object):
+
+    def __init__(self, points):
+        self.points = points
+        self.submitted = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """
+    A coalescer of concurrent prediction requests: a background thread
+    takes the waiting requests, up to *max_batch* locations or
+    *max_wait* seconds after the first one, and answers them all with
+    one call of *predict*. If the call fails, each request of the batch
+    is predicted on its own, so that a failing request does not fail the
+    others.
+
+    :param function predict:
+        the batch prediction, from an array of locations (one per row) to
+        an array of neighborhoods
+    :param int max_batch: the largest batch, in locations, default is 4096
+    :param float max_wait:
+        the longest time the first request of a batch waits for others,
+        default is 0.002
+    :param metrics:
+        (optional) the :class:`ServiceMetrics` to record into, default is
+        new metrics
+
+    For example,
+
+    >>> from nbdtools.nbdpred import NbdPred
+    >>> from nbdtools.service import MicroBatcher
+    >>> npred = NbdPred([[0, 0, 'A'], [0, 1, 'A'], [2, 0, 'B'], [2, 1, 'B']])
+    >>> batcher = MicroBatcher(npred.predict)
+    >>> batcher.start()
+    >>> batcher.submit([[0, 2], [3, 0]])
+    ['A', 'B']
+    >>> batcher.metrics.snapshot()['points']
+    2
+    >>> batcher.submit([[float('nan'), 0]])
+    Traceback (most recent call last):
+    ...
+    ValueError: Locations must be finite
+    >>> batcher.stop()
+
+    """
+
+    def __init__(self, predict, max_batch=4096, max_wait=0.002,
+                 metrics=None):
+
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or ServiceMetrics()
+        self._queue = Queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the batching thread.
+
+        """
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Answer the waiting requests and stop the batching thread.
+
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, points, timeout=None):
+        """
+        Predict the neighborhoods of *points* (pairs of latitude and
+        longitude), in a batch with the concurrent requests.
+
+        :returns: the neighborhood of each location
+        :rtype: list
+
+        :raises ValueError: if a location is not a finite pair
+        :raises Exception: if the prediction failed or timed out
+
+        """
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not np.isfinite(points).all():
+            #rejected here, so that it fails no batch
+            raise ValueError('Locations must be finite')
+        request = _Request(points)
+        self._queue.put(request)
+        #a timeout keeps the wait interruptible
+        if not request.done.wait(timeout or 1e9):
+            raise Exception('Lookup timed out')
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self, first):
+        batch = [first]
+        points = len(first.points)
+        deadline = time.time() + self.max_wait
+        while points < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if request is None:
+                #stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(request)
+            points += len(request.points)
+        return batch, points
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, points = self._collect(first)
+            self._predict(batch)
+            done = time.time()
+            for request in batch:
+                request.done.set()
+            self.metrics.record_batch([done - request.submitted
+                                       for request in batch], points,
+                                      error=any(request.error is not None
+                                                for request in batch))
+
+    def _predict(self, batch):
+        try:
+            nbds = list(self.predict(np.concatenate(
+                [request.points for request in batch])))
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                for request in batch:
+                    self._predict([request])
+            return
+        start = 0
+        for request in batch:
+            end = start + len(request.points)
+            request.result = nbds[start:end]
+            start = end
+
+
+class LookupHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    The HTTP handler of the lookup service.
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _lookup(self, points):
+        return self.server.batcher.submit(points,
+                                          timeout=self.server.timeout_s)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        try:
+            if url.path == '/lookup':
+                query = urlparse.parse_qs(url.query)
+                point = [float(query['lat'][0]), float(query['lon'][0])]
+                self._send_json(200, {'nbd' : self._lookup([point])[0]})
+            elif url.path == '/metrics':
+                self._send_json(200, self.server.batcher.metrics.snapshot())
+            elif url.path == '/health':
+                self._send_json(200, {'status' : 'ok'})
+            else:
+                self._send_json(404, {'error' : 'Not found'})
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {'error' : 'Bad request: {}'.format(e)})
+        except Exception as e:
+            self._send_json(500, {'error' : str(e)})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if url.path != '/lookup':
+            self._send_json(404, {'error' : 'Not found'})
+            return
+        try:
+            points = json.loads(body)['points']
+            self._send_json(200, {'nbds' : self._lookup(points)})
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {'error' : 'Bad request: {}'.format(e)})
+        except Exception as e:
+            self._send_json(500, {'error' : str(e)})
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    #a full backlog makes Unix socket clients fail rather than retry
+    request_queue_size = 128
+
+
+class LookupServer(object):
+    """
+    A lookup service of the predictor *npred*.
+
+    :param npred: the :class:`NbdPred`, trained by :meth:`NbdPred.fit` if
+        it is not already
+    :param address:
+        the address to listen on: a (host, port) tuple, where port 0
+        picks a free port, or the path of a Unix socket; default is
+        ('127.0.0.1', 8765)
+    :param float timeout_s:
+        the longest a request waits for its batch, default is 10
+
+    The other keyword arguments are passed to :class:`MicroBatcher`.
+
+    For example, we start a service on a free port, and look up locations.
+
+    >>> from nbdtools.nbdpred import NbdPred
+    >>> from nbdtools.service import LookupServer, lookup, get_metrics
+    >>> npred = NbdPred([[0, 0, 'A'], [0, 1, 'A'], [2, 0, 'B'], [2, 1, 'B']])
+    >>> server = LookupServer(npred, address=('127.0.0.1', 0))
+    >>> server.start()
+    >>> lookup([[0, 2], [3, 0]], server.address)
+    [u'A', u'B']
+    >>> get_metrics(server.address)['requests']
+    1
+    >>> server.shutdown()
+
+    """
+
+    def __init__(self, npred, address=('127.0.0.1', 8765), timeout_s=10.,
+                 **kwargs):
+
+        if npred.NN is None:
+            npred.fit()
+        self.npred = npred
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _UnixServer(address, LookupHandler)
+        else:
+            self.server = _TCPServer(tuple(address), LookupHandler)
+        self.server.batcher = MicroBatcher(npred.predict, **kwargs)
+        self.server.timeout_s = timeout_s
+        self._thread = None
+
+    @property
+    def address(self):
+        """The address listened on, with the port picked if it was 0."""
+        return self.server.server_address
+
+    @property
+    def metrics(self):
+        """The :class:`ServiceMetrics` of the service."""
+        return self.server.batcher.metrics
+
+    def serve_forever(self):
+        """
+        Serve requests until :meth:`shutdown` is called.
+
+        """
+
+        self.server.batcher.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.batcher.stop()
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+
+        """
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        """
+        Stop serving requests, and close the socket.
+
+        """
+
+        self.server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        if isinstance(self.address, basestring) and \
+                os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, path, timeout):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _request(address, method, path, body=None, timeout=10):
+    if isinstance(address, basestring):
+        con = _UnixHTTPConnection(address, timeout)
+    else:
+        con = httplib.HTTPConnection(address[0], address[1], timeout=timeout)
+    try:
+        headers = {'Content-Type' : 'application/json'} if body else {}
+        con.request(method, path, body, headers)
+        response = con.getresponse()
+        result = json.loads(response.read())
+    finally:
+        con.close()
+    if response.status != 200:
+        raise Exception(result.get('error', response.reason))
+    return result
+
+
+def lookup(points, address=('127.0.0.1', 8765), timeout=10):
+    """
+    Look up the neighborhoods of *points* (pairs of latitude and
+    longitude) in the service at *address* (see :class:`LookupServer`).
+
+    :rtype: list
+
+    """
+
+    body = json.dumps({'points' : np.asarray(points, dtype=float).tolist()})
+    return _request(address, 'POST', '/lookup', body, timeout)['nbds']
+
+
+def get_metrics(address=('127.0.0.1', 8765), timeout=10):
+    """
+    Get the metrics of the service at *address*.
+
+    :rtype: dict
+
+    """
+
+    return _request(address, 'GET', '/metrics', timeout=timeout)
+
+
+def load_places(filename, latname='latitude', longname='longitude',
+                nbdname='nbd', sep=','):
+    """
+    Read the places whose neighborhood is known from the csv file
+    *filename*, in the format of the parameter of :class:`NbdPred`.
+
+    """
+
+    import pandas as pd
+
+    df = pd.read_csv(filename, sep=sep, usecols=[latname, longname, nbdname])
+    df = df.dropna()
+    return [[lat, lon, nbd] for lat, lon, nbd in
+            zip(df[latname], df[longname], df[nbdname])]
+
+
+def main(argv=None):
+    summary = __doc__.split('\n\n')[0].strip()
+    parser = argparse.ArgumentParser(description=summary)
+    parser.add_argument('places', help='csv file of places with a known '
+                        'neighborhood')
+    parser.add_argument('--latname', default='latitude')
+    parser.add_argument('--longname', default='longitude')
+    parser.add_argument('--nbdname', default='nbd')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help='serve on this Unix socket instead')
+    parser.add_argument('--max-batch', type=int, default=4096)
+    parser.add_argument('--max-wait-ms', type=float, default=2.)
+    args = parser.parse_args(argv)
+
+    npred = NbdPred(load_places(args.places, latname=args.latname,
+                                longname=args.longname,
+                                nbdname=args.nbdname))
+    address = args.socket or (args.host, args.port)
+    server = LookupServer(npred, address=address, max_batch=args.max_batch,
+                          max_wait=args.max_wait_ms / 1000.)
+    print 'Serving {} places on {}'.format(len(npred.loc_and_n),
+                                           server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ from distutils.core import setup
 setup(
     name = "gentrySeattle",
     version = "0.1",
-    packages = ["nbdtools"],
+    packages = ["nbdtools", "datatools"],
     author = "Yao Gbanaglo and Gautam Sisodia",
     author_email = "gautam.sisodia@gmail.com",
     description = "A package of tools to study gentrification manifest in Seattle gov's open data.",